@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+"""Finds stations in the RadioBrowser dump that point at the same stream.
+
+Every url and url_resolved is reduced to a canonical key: the scheme is
+dropped (http and https of one server are the same stream), the host is
+lowercased with the default port removed, the path loses its trailing
+slash or the Shoutcast ';' and the query parameters are sorted. Stations
+that share any key are joined into one cluster with a union-find over a
+key -> station dict, so the whole pass is O(n).
+
+The clusters go to DUPLICATES_FILE as JSON lines, with a primary station
+chosen by lastcheckok, votes, clickcount and https.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import urllib.parse
+from array import array
+
+
+def load_script(name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_").removesuffix(".py"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+dl = load_script("download-all-stations.py")
+
+DUPLICATES_FILE = "radio-browser.stations.duplicates.tmp"
+DEFAULT_PORTS = {"http": 80, "https": 443}
+UNRESERVED = "-._~"
+
+
+def canonical_url(url: str, drop_www: bool = False) -> str:
+    """Returns the canonical form of url, or "" when it is not a URL.
+
+    The scheme is kept, see url_key() for the scheme-less key.
+    """
+    url = (url or "").strip()
+    if not url:
+        return ""
+    if "://" not in url:
+        url = "http://" + url
+
+    try:
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return ""
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").rstrip(".")
+    if not host:
+        return ""
+    try:
+        host = host.encode("idna").decode("ascii")
+    except UnicodeError:
+        pass
+    if drop_www and host.startswith("www."):
+        host = host[4:]
+    if ":" in host:
+        # hostname drops the brackets of an IPv6 literal
+        host = f"[{host}]"
+    if port and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+
+    # unquote what needs no quoting, quote what must be quoted
+    path = urllib.parse.quote(urllib.parse.unquote(parts.path), safe="/;:@!$&'()*+,=" + UNRESERVED)
+    if path.endswith("/;"):
+        path = path[:-1]
+    path = path.rstrip("/")
+
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+    return urllib.parse.urlunsplit((scheme, host, path, query, ""))
+
+
+def url_key(url: str) -> str:
+    canonical = canonical_url(url)
+    return canonical.split("://", 1)[1] if canonical else ""
+
+
+class Clusters:
+    """Union-find over station numbers."""
+
+    def __init__(self):
+        self.parent = array("I")
+
+    def add(self) -> int:
+        self.parent.append(len(self.parent))
+        return len(self.parent) - 1
+
+    def find(self, n: int) -> int:
+        parent = self.parent
+        root = n
+        while parent[root] != root:
+            root = parent[root]
+        while parent[n] != root:
+            parent[n], n = root, parent[n]
+        return root
+
+    def union(self, a: int, b: int) -> None:
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+
+def rank(obj: dict) -> tuple:
+    """The primary of a cluster has the highest rank."""
+    def number(key):
+        value = obj.get(key)
+        return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+    url = obj.get("url_resolved") or obj.get("url") or ""
+    return (number("lastcheckok"), number("votes"), number("clickcount"), url.lower().startswith("https:"))
+
+
+def dedupe(src: str, dest: str) -> None:
+    print(f"Reading {src} ...")
+    clusters = Clusters()
+    owners = {}       # canonical key -> the first station with it
+    stations = []     # (stationuuid, name, url, url_resolved, homepage, rank)
+
+    with open(src, "r", encoding="utf-8") as f:
+        for obj in dl.iter_stations(f):
+            if not isinstance(obj, dict):
+                continue
+            n = clusters.add()
+            url = canonical_url(obj.get("url"))
+            resolved = canonical_url(obj.get("url_resolved"))
+            homepage = canonical_url(obj.get("homepage"), drop_www=True)
+            stations.append((obj.get("stationuuid"), obj.get("name"), url, resolved, homepage, rank(obj)))
+
+            for key in {url_key(url), url_key(resolved)}:
+                if key:
+                    owner = owners.setdefault(key, n)
+                    if owner != n:
+                        clusters.union(owner, n)
+
+            if (n + 1) % 10000 == 0:
+                print(f"\r  Processed {n + 1}", end="", flush=True)
+
+    groups = {}
+    for n in range(len(stations)):
+        root = clusters.find(n)
+        if root != n:
+            groups.setdefault(root, [root]).append(n)
+
+    duplicates = 0
+    tmp = dest + ".part"
+    with open(tmp, "w", encoding="utf-8") as out:
+        for members in groups.values():
+            members.sort(key=lambda n: stations[n][5], reverse=True)
+            primary = members[0]
+            duplicates += len(members) - 1
+
+            def describe(n):
+                uuid, name, url, resolved, homepage, _ = stations[n]
+                return {"stationuuid": uuid, "name": name, "url": url, "url_resolved": resolved, "homepage": homepage}
+
+            out.write(json.dumps({
+                "key": url_key(stations[primary][3] or stations[primary][2]),
+                "primary": describe(primary),
+                "duplicates": [describe(n) for n in members[1:]],
+            }, ensure_ascii=False) + "\n")
+    os.replace(tmp, dest)
+
+    print(f"\r  Stations: {len(stations)}, distinct streams: {len(stations) - duplicates}, "
+          f"clusters: {len(groups)}, duplicates: {duplicates}")
+    print(f"Saved to {dest}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find RadioBrowser stations that point at the same stream.")
+    parser.add_argument("--dump", default=dl.INPUT_FILE,
+                        help=f"the catalogue dump, downloaded when missing (default: {dl.INPUT_FILE})")
+    parser.add_argument("--output", default=DUPLICATES_FILE,
+                        help=f"duplicate clusters, JSON lines (default: {DUPLICATES_FILE})")
+    args = parser.parse_args()
+
+    try:
+        if not dl.is_valid(args.dump):
+            dl.download(dl.API_URL, args.dump)
+        dedupe(args.dump, args.output)
+    except dl.Error as err:
+        print(f"Error: {err}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
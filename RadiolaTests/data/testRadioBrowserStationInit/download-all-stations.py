@@ -1,63 +1,1080 @@
 #!/usr/bin/env python3
 
+import argparse
+import array
+import collections
+import contextlib
+import hashlib
+import http.client
+import io
 import json
+import mmap
 import os
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
 API_URL = "http://de1.api.radio-browser.info/json/stations?limit=999999"
+MIRRORS = ["de1.api.radio-browser.info", "de2.api.radio-browser.info", "fi1.api.radio-browser.info"]
 INPUT_FILE = "radio-browser.stations.json.tmp"
+STORE_FILE = "radio-browser.stations.store.tmp"
+STATE_FILE = "radio-browser.stations.state.tmp"
 OUTPUT_PREFIX = "tmp_"
 DIGITS = 5
+CHUNK_SIZE = 1024 * 256  # 256 KB
+WRITERS = 8
+MAX_PENDING_WRITES = 1000
+MAX_RETRIES = 10
+USER_AGENT = "split-stations/1.0"
+DELTA_PAGE_SIZE = 10000
+DELTA_BATCH_SIZE = 1000
+PAGE_SIZE = 5000
+MIRROR_RATE = 2          # requests per second
+MIRROR_CONNECTIONS = 2
+MIRROR_COOLDOWN = 30     # seconds
 
-def download(url: str, dest: str) -> None:
-    print(f"Downloading {url} ...")
-    req = urllib.request.Request(url, headers={"User-Agent": "split-stations/1.0"})
-    with urllib.request.urlopen(req) as resp, open(dest, "wb") as f:
-        total = int(resp.headers.get("Content-Length", 0))
-        downloaded = 0
-        chunk = 1024 * 256  # 256 KB
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")
+
+
+class Error(Exception):
+    pass
+
+
+class Download(io.RawIOBase):
+    """Downloads url to dest and returns the body as it is read.
+
+    The data goes to dest.part first. A dropped connection is resumed with
+    a Range request from the current offset, and so is a .part file left
+    by an interrupted run. The validators of the first response are kept
+    in dest.part.meta and sent in If-Range, so a changed dump is never
+    glued to an old part. When the body is complete, its length is checked
+    against Content-Length/Content-Range, the SHA-256 is saved to
+    dest.sha256 and dest.part is atomically renamed to dest.
+    """
+
+    def __init__(self, url: str, dest: str, sha256: str = None):
+        self.url = url
+        self.dest = dest
+        self.part = dest + ".part"
+        # not *.json: the app tests read every JSON file here as a station
+        self.meta_file = self.part + ".meta"
+        self.sha256 = sha256
+        self.hash = hashlib.sha256()
+        self.offset = 0           # bytes passed to the reader
+        self.total = None
+        self.local = None         # the part saved by a previous run
+        self.out = None
+        self.resp = None
+        self.retries = 0
+        self.done = False
+
+    def readable(self) -> bool:
+        return True
+
+    def _load_meta(self) -> dict:
+        try:
+            with open(self.meta_file, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            return meta if meta.get("url") == self.url else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _connect(self, offset: int, meta: dict):
+        """Requests the body from offset, returns the HTTP status."""
+        headers = {"User-Agent": USER_AGENT}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            validator = meta.get("etag") or meta.get("last_modified")
+            if validator:
+                headers["If-Range"] = validator
+
+        try:
+            self.resp = urllib.request.urlopen(urllib.request.Request(self.url, headers=headers))
+        except urllib.error.HTTPError as err:
+            if err.code == 416 and offset:
+                # the part is already complete
+                m = re.match(r"bytes \*/(\d+)", err.headers.get("Content-Range", ""))
+                if m and int(m.group(1)) == offset:
+                    self.resp = None
+                    return 416
+            raise Error(f"can't download {self.url}: {err}")
+        except (urllib.error.URLError, http.client.HTTPException) as err:
+            raise Error(f"can't download {self.url}: {err}")
+
+        status = self.resp.status
+        if status == 206:
+            m = re.match(r"bytes (\d+)-\d+/(\d+|\*)", self.resp.headers.get("Content-Range", ""))
+            if not m or int(m.group(1)) != offset:
+                raise Error(f"unexpected Content-Range from {self.url}")
+            if m.group(2) != "*":
+                self.total = int(m.group(2))
+        else:
+            length = self.resp.headers.get("Content-Length")
+            self.total = int(length) if length else None
+        return status
+
+    def _start(self):
+        meta = self._load_meta()
+        size = os.path.getsize(self.part) if meta and os.path.exists(self.part) else 0
+
+        status = self._connect(size, meta)
+        if status in (206, 416):
+            print(f"  Resuming from {size // 1024 // 1024} MB")
+            if status == 416:
+                self.total = size
+            self.local = open(self.part, "rb")
+            self.out = open(self.part, "ab")
+            return
+
+        # a fresh start, the server may have ignored Range or the dump has changed
+        self.out = open(self.part, "wb")
+        self._save_meta()
+
+    def _save_meta(self):
+        with contextlib.suppress(OSError):
+            # the meta file of older versions, it was a *.json
+            os.remove(self.part + ".json")
+        with open(self.meta_file, "w", encoding="utf-8") as f:
+            json.dump({
+                "url": self.url,
+                "etag": self.resp.headers.get("ETag"),
+                "last_modified": self.resp.headers.get("Last-Modified"),
+            }, f)
+
+    def _reconnect(self, err):
         while True:
-            block = resp.read(chunk)
-            if not block:
+            self.retries += 1
+            if self.retries > MAX_RETRIES:
+                raise Error(f"can't download {self.url}: {err}")
+
+            delay = min(2 ** self.retries, 60)
+            print(f"\n  Connection lost ({err or type(err).__name__}), resuming in {delay} s")
+            time.sleep(delay)
+
+            if self.resp:
+                self.resp.close()
+            try:
+                status = self._connect(self.offset, self._load_meta())
+            except (Error, OSError) as e:
+                err = e
+                continue
+
+            if status == 200 and self.offset == 0:
+                # nothing was read yet, so this is just a fresh start
+                self.out.seek(0)
+                self.out.truncate()
+                self._save_meta()
+            elif status == 200:
+                raise Error(f"{self.url} has changed during the download")
+            return
+
+    def readinto(self, buffer) -> int:
+        if self.done:
+            return 0
+
+        if self.out is None:
+            self._start()
+
+        n = 0
+        if self.local:
+            n = self.local.readinto(buffer)
+            if not n:
+                self.local.close()
+                self.local = None
+
+        while not n and self.resp:
+            try:
+                n = self.resp.readinto(buffer)
+            except (OSError, http.client.HTTPException) as err:
+                self._reconnect(err)
+                continue
+
+            if n:
+                self.out.write(buffer[:n])
+                self.retries = 0
+            elif self.total is not None and self.offset < self.total:
+                self._reconnect(Error("the connection was closed early"))
+            else:
                 break
-            f.write(block)
-            downloaded += len(block)
-            if total:
-                pct = downloaded * 100 // total
-                print(f"\r  {downloaded // 1024 // 1024} MB / {total // 1024 // 1024} MB ({pct}%)", end="", flush=True)
+
+        if not n:
+            self._finish()
+            return 0
+
+        self.hash.update(buffer[:n])
+        self.offset += n
+        return n
+
+    def _finish(self):
+        self.done = True
+        self.out.close()
+        if self.resp:
+            self.resp.close()
+
+        if self.total is not None and self.offset != self.total:
+            raise Error(f"got {self.offset} bytes of {self.total} from {self.url}")
+
+        digest = self.hash.hexdigest()
+        if self.sha256 and digest != self.sha256.lower():
+            os.remove(self.part)
+            os.remove(self.meta_file)
+            raise Error(f"SHA-256 mismatch for {self.url}: {digest}")
+
+        with open(self.dest + ".sha256", "w", encoding="utf-8") as f:
+            f.write(digest + "\n")
+        os.replace(self.part, self.dest)
+        os.remove(self.meta_file)
+
+    def close(self):
+        for f in (self.local, self.out, self.resp):
+            if f:
+                f.close()
+        super().close()
+
+
+def is_valid(path: str, sha256: str = None) -> bool:
+    """Checks a downloaded file against the SHA-256 saved next to it and,
+    when given, against the expected one."""
+    try:
+        with open(path + ".sha256", "r", encoding="utf-8") as f:
+            expected = f.read().strip()
+    except OSError:
+        return False
+    if sha256 and sha256.lower() != expected:
+        return False
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(CHUNK_SIZE):
+            h.update(block)
+    return h.hexdigest() == expected
+
+
+def download(url: str, dest: str, sha256: str = None) -> None:
+    print(f"Downloading {url} ...")
+    with Download(url, dest, sha256) as d:
+        buffer = memoryview(bytearray(CHUNK_SIZE))
+        while d.readinto(buffer):
+            if d.total:
+                pct = d.offset * 100 // d.total
+                print(f"\r  {d.offset // 1024 // 1024} MB / {d.total // 1024 // 1024} MB ({pct}%)", end="", flush=True)
     print(f"\nSaved to {dest}")
 
 
+def iter_stations(f, chunk_size: int = CHUNK_SIZE):
+    """Yields the elements of the top-level JSON array one at a time.
+
+    Only the current element and one chunk of the text file are kept in
+    memory, so the whole dump is never loaded at once.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    state = "start"  # start -> first -> (value -> separator)* -> end
+
+    while True:
+        pos = WHITESPACE.match(buf, pos).end()
+        if pos == len(buf):
+            if eof:
+                raise Error("unexpected end of the JSON data.")
+            buf = f.read(chunk_size)
+            pos = 0
+            eof = not buf
+            continue
+
+        if state == "start":
+            if buf[pos] != "[":
+                raise Error("the root element is not an array.")
+            pos += 1
+            state = "first"
+            continue
+
+        if state in ("first", "separator") and buf[pos] == "]":
+            return
+
+        if state == "separator":
+            if buf[pos] != ",":
+                raise Error(f"expected ',' or ']', got {buf[pos]!r}.")
+            pos += 1
+            state = "value"
+            continue
+
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError as err:
+            if eof:
+                raise Error(f"invalid JSON: {err}")
+            obj, end = None, len(buf)
+
+        if not eof and NUMBER_TAIL.match(buf, end).end() == len(buf):
+            # the element may continue in the next chunk, a number cut
+            # after "-1." or "1e" parses as a shorter one
+            more = f.read(chunk_size)
+            eof = not more
+            buf = buf[pos:] + more
+            pos = 0
+            continue
+
+        pos = end
+        state = "separator"
+        yield obj
+
+
+def write_station(idx: int, obj) -> None:
+    filename = f"{OUTPUT_PREFIX}{idx:0{DIGITS}d}.json"
+    with open(filename, "w", encoding="utf-8") as out:
+        json.dump(obj, out, indent=2, ensure_ascii=False)
+
+
+def write_stations(stations) -> int:
+    """Writes every station to its own file on a pool of writer threads.
+
+    Returns the number of stations.
+    """
+    total = 0
+    pending = []
+    with ThreadPoolExecutor(max_workers=WRITERS) as pool:
+        for idx, obj in enumerate(stations, start=1):
+            pending.append(pool.submit(write_station, idx, obj))
+            if len(pending) >= MAX_PENDING_WRITES:
+                for f in pending:
+                    f.result()
+                pending.clear()
+
+            if idx % 1000 == 0:
+                print(f"  Processed {idx}")
+            total = idx
+
+        for f in pending:
+            f.result()
+
+    return total
+
+
 def split(src: str) -> None:
     print(f"Loading {src} ...")
     with open(src, "r", encoding="utf-8") as f:
-        data = json.load(f)
+        total = write_stations(iter_stations(f))
+
+    print(f"Total stations: {total}")
+    print("Done.")
+
 
-    if not isinstance(data, list):
-        print("Error: the root element is not an array.")
-        return
+def download_and_split(url: str, dest: str, sha256: str = None) -> None:
+    """Parses and writes stations while the dump is still downloading."""
+    print(f"Downloading and splitting {url} ...")
+    with Download(url, dest, sha256) as d:
+        text = io.TextIOWrapper(io.BufferedReader(d, CHUNK_SIZE), encoding="utf-8")
+        total = write_stations(iter_stations(text))
+        # the parser stops at the closing bracket, take the rest to complete the file
+        while text.read(CHUNK_SIZE):
+            pass
 
-    total = len(data)
+    print(f"Saved to {dest}")
     print(f"Total stations: {total}")
+    print("Done.")
+
+
+
+#######################################
+# Columnar store: the whole catalogue in one file
+#
+# Layout: MAGIC, u64 length of the JSON header, the header, then sections
+# aligned to 8 bytes. Every column is a typed array with one item per
+# station, so a station is read from fixed positions of each column.
+#
+#   q - int64, d - float64, b - int8 (bool),
+#   v - uint32 index in the value table
+#
+# The value table keeps every distinct value once: a uint64 offsets array
+# and the data, each value is b"s" + UTF-8 for strings or b"j" + JSON.
+# A column with nulls or missing keys has a state byte per station:
+# 0 - value, 1 - null, 2 - missing. All numbers are little-endian.
+
+STORE_MAGIC = b"RBSTORE1"
+PRESENT, NULL, MISSING = 0, 1, 2
+ARRAY_TYPES = {"q": "q", "d": "d", "b": "b", "v": "I"}
+
+
+def column_type(t: str, value) -> str:
+    """Returns the column type that fits both t and value."""
+    if value is None or t == "v":
+        return t
+    if isinstance(value, bool):
+        kind = "b"
+    elif isinstance(value, int) and -2 ** 63 <= value < 2 ** 63:
+        kind = "q"
+    elif isinstance(value, float):
+        kind = "d"
+    else:
+        kind = "v"
+    return kind if t in (None, kind) else "v"
+
+
+def encode_value(value) -> bytes:
+    if isinstance(value, str):
+        return b"s" + value.encode("utf-8")
+    return b"j" + json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def decode_value(data: bytes):
+    if data[:1] == b"s":
+        return data[1:].decode("utf-8")
+    return json.loads(data[1:].decode("utf-8"))
+
+
+def align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def write_store(src: str, dest: str) -> None:
+    """Builds the columnar store from the JSON dump in two streaming passes:
+    the first one finds the columns and their types, the second one fills
+    them."""
+    print(f"Building {dest} from {src} ...")
+    types = {}
+    count = 0
+    with open(src, "r", encoding="utf-8") as f:
+        for obj in iter_stations(f):
+            if not isinstance(obj, dict):
+                raise Error("stations must be JSON objects.")
+            for key, value in obj.items():
+                types[key] = column_type(types.get(key), value)
+            count += 1
+
+    # a column with nulls only is stored as bool
+    types = {key: t or "b" for key, t in types.items()}
+    columns = {key: array.array(ARRAY_TYPES[t]) for key, t in types.items()}
+    states = {key: bytearray() for key in types}
+    values = {}
+
+    with open(src, "r", encoding="utf-8") as f:
+        for obj in iter_stations(f):
+            for key, t in types.items():
+                value = obj.get(key)
+                if value is None:
+                    states[key].append(NULL if key in obj else MISSING)
+                    columns[key].append(0)
+                elif t == "v":
+                    states[key].append(PRESENT)
+                    columns[key].append(values.setdefault(encode_value(value), len(values)))
+                else:
+                    states[key].append(PRESENT)
+                    columns[key].append(value)
+
+    offsets = array.array("Q", [0])
+    for v in values:
+        offsets.append(offsets[-1] + len(v))
+
+    sections = []
+
+    def add(data) -> int:
+        if isinstance(data, array.array) and sys.byteorder == "big":
+            data.byteswap()
+        sections.append(memoryview(data).cast("B"))
+        return len(sections) - 1
+
+    header = {
+        "count": count,
+        "columns": [{
+            "name": key,
+            "type": t,
+            "data": add(columns[key]),
+            "state": add(states[key]) if any(states[key]) else None,
+        } for key, t in types.items()],
+        "values": {"offsets": add(offsets), "data": add(b"".join(values))},
+    }
+
+    # the header holds the [offset, size] of every section, and the
+    # offsets depend on the header size, so grow it until it fits
+    size = 0
+    while True:
+        places = []
+        pos = align(len(STORE_MAGIC) + 8 + size)
+        for data in sections:
+            places.append([pos, len(data)])
+            pos = align(pos + len(data))
+
+        def place(n):
+            return places[n] if n is not None else None
 
-    for idx, obj in enumerate(data, start=1):
-        filename = f"{OUTPUT_PREFIX}{idx:0{DIGITS}d}.json"
-        with open(filename, "w", encoding="utf-8") as out:
-            json.dump(obj, out, indent=2, ensure_ascii=False)
-        if idx % 1000 == 0 or idx == total:
-            print(f"  Processed {idx} of {total}")
+        data = json.dumps({
+            "count": count,
+            "columns": [dict(c, data=place(c["data"]), state=place(c["state"])) for c in header["columns"]],
+            "values": {k: place(n) for k, n in header["values"].items()},
+        }).encode("utf-8")
 
+        if len(data) <= size:
+            break
+        size = len(data) + 64
+
+    tmp = dest + ".part"
+    with open(tmp, "wb") as out:
+        out.write(STORE_MAGIC)
+        out.write(size.to_bytes(8, "little"))
+        out.write(data.ljust(size))
+        for section, (pos, _) in zip(sections, places):
+            out.write(b"\0" * (pos - out.tell()))
+            out.write(section)
+    os.replace(tmp, dest)
+
+    print(f"  {count} stations, {len(types)} columns, {len(values)} distinct values")
+    print(f"Saved to {dest} ({os.path.getsize(dest) // 1024} KB)")
+
+
+class StationStore:
+    """Reads stations from the columnar store through mmap, only the pages
+    of the requested station are touched.
+
+        with StationStore(STORE_FILE) as store:
+            print(len(store), store[42])
+    """
+
+    def __init__(self, path: str):
+        if sys.byteorder == "big":
+            raise Error("the station store is little-endian.")
+
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.map)
+
+        if view[:len(STORE_MAGIC)] != STORE_MAGIC:
+            raise Error(f"{path} is not a station store.")
+        pos = len(STORE_MAGIC)
+        size = int.from_bytes(view[pos:pos + 8], "little")
+        header = json.loads(bytes(view[pos + 8:pos + 8 + size]))
+
+        def section(place, fmt):
+            start, length = place
+            return view[start:start + length].cast(fmt)
+
+        self.count = header["count"]
+        self.columns = []
+        for c in header["columns"]:
+            state = section(c["state"], "B") if c["state"] else None
+            self.columns.append((c["name"], c["type"], section(c["data"], ARRAY_TYPES[c["type"]]), state))
+
+        self.offsets = section(header["values"]["offsets"], "Q")
+        self.values = section(header["values"]["data"], "B")
+        self.view = view
+
+    def __len__(self) -> int:
+        return self.count
+
+    def value(self, index: int):
+        return decode_value(self.values[self.offsets[index]:self.offsets[index + 1]].tobytes())
+
+    def __getitem__(self, idx: int) -> dict:
+        if not 0 <= idx < self.count:
+            raise IndexError(idx)
+
+        obj = {}
+        for name, t, data, state in self.columns:
+            st = state[idx] if state is not None else PRESENT
+            if st == MISSING:
+                continue
+            if st == NULL:
+                obj[name] = None
+            elif t == "v":
+                obj[name] = self.value(data[idx])
+            elif t == "b":
+                obj[name] = bool(data[idx])
+            else:
+                obj[name] = data[idx]
+        return obj
+
+    def __iter__(self):
+        return (self[i] for i in range(self.count))
+
+    def close(self) -> None:
+        # all views must be released before the map can be closed
+        for _, _, data, state in self.columns:
+            data.release()
+            if state is not None:
+                state.release()
+        self.columns = []
+        self.offsets.release()
+        self.values.release()
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+#######################################
+# Delta sync: fetch only the stations changed since the last run
+#
+# STATE_FILE keeps stationuuid -> [changeuuid, lastchangetime_iso8601] of
+# the local dump and the changeuuid of the last applied change. The change
+# feed returns every edit after that change in order, the same station may
+# appear several times and the last edit wins. Its records are station
+# history without the check and click fields, so only the uuids are taken
+# from it and the full stations are fetched by uuid. The feed has no
+# deletions, so when the number of stations differs from /json/stats, the
+# local stations are looked up by uuid to find the deleted ones.
+
+def api_base(url: str) -> str:
+    parts = urllib.parse.urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def catalogue_size(stats: dict, hidebroken: bool = False) -> int:
+    """The number of stations /json/stations returns. /json/stats counts
+    the broken ones separately, they are listed unless hidebroken."""
+    return stats.get("stations", 0) + (0 if hidebroken else stats.get("stations_broken", 0))
+
+
+def fetch_json(url: str, data: dict = None):
+    """GETs url, or POSTs the data as a form, and returns the parsed JSON."""
+    body = urllib.parse.urlencode(data).encode("ascii") if data is not None else None
+    req = urllib.request.Request(url, data=body, headers={"User-Agent": USER_AGENT})
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            with urllib.request.urlopen(req, timeout=60) as resp:
+                return json.load(resp)
+        except (urllib.error.URLError, http.client.HTTPException, OSError) as err:
+            if isinstance(err, urllib.error.HTTPError) and err.code < 500:
+                raise Error(f"{url}: HTTP {err.code}")
+            if attempt == MAX_RETRIES:
+                raise Error(f"{url}: {err}")
+            time.sleep(min(2 ** attempt, 30))
+
+
+def station_state(obj: dict) -> list:
+    return [obj.get("changeuuid"), obj.get("lastchangetime_iso8601") or ""]
+
+
+def save_state(src: str, dest: str, last_change: str = None) -> None:
+    """Remembers the version of every station in src. Records without a
+    stationuuid can't be tracked by the change feed and are skipped."""
+    stations = {}
+    latest = ["", ""]
+    with open(src, "r", encoding="utf-8") as f:
+        for obj in iter_stations(f):
+            uuid = obj.get("stationuuid") if isinstance(obj, dict) else None
+            if not uuid:
+                continue
+            state = station_state(obj)
+            stations[uuid] = state
+            if state[1] >= latest[1]:
+                latest = state
+
+    tmp = dest + ".part"
+    with open(tmp, "w", encoding="utf-8") as out:
+        json.dump({"lastchangeuuid": last_change or latest[0], "stations": stations}, out)
+    os.replace(tmp, dest)
+
+
+def load_state(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as err:
+        raise Error(f"can't read {path}, run a full download first: {err}")
+
+
+def fetch_changes(base: str, last_change: str) -> tuple:
+    """Returns {stationuuid: changeuuid} of the stations changed after
+    last_change and the changeuuid of the last change."""
+    changed = {}
+    offset = 0
+    while True:
+        query = urllib.parse.urlencode({"lastchangeuuid": last_change, "offset": offset, "limit": DELTA_PAGE_SIZE})
+        page = fetch_json(f"{base}/json/stations/changed?{query}")
+        for obj in page:
+            changed[obj["stationuuid"]] = obj.get("changeuuid")
+        if page:
+            last = page[-1]["changeuuid"]
+        print(f"\r  Changes: {offset + len(page)}", end="", flush=True)
+        if len(page) < DELTA_PAGE_SIZE:
+            print()
+            return changed, (last if offset + len(page) else last_change)
+        offset += len(page)
+
+
+def fetch_stations(base: str, uuids: list) -> dict:
+    """Returns {stationuuid: station} of the uuids that are still in the
+    catalogue."""
+    found = {}
+    for i in range(0, len(uuids), DELTA_BATCH_SIZE):
+        batch = uuids[i:i + DELTA_BATCH_SIZE]
+        for obj in fetch_json(f"{base}/json/stations/byuuid", {"uuids": ",".join(batch)}):
+            found[obj["stationuuid"]] = obj
+    return found
+
+
+def find_deleted(base: str, uuids: list) -> set:
+    """Returns the uuids that are no longer in the catalogue."""
+    return set(uuids) - set(fetch_stations(base, uuids))
+
+
+def write_dump(src: str, dest: str, changed: dict, deleted: set) -> tuple:
+    """Writes src with the changes applied: updated stations stay in place,
+    deleted ones are dropped and new ones are appended. Returns the list of
+    1-based positions of the updated stations, the position of the first
+    shifted station (or None) and the total."""
+    h = hashlib.sha256()
+    updated = []
+    first_shifted = None
+    idx = 0
+    tmp = dest + ".part"
+
+    with open(src, "r", encoding="utf-8") as f, open(tmp, "wb") as out:
+        def emit(obj):
+            nonlocal idx
+            data = ("[" if idx == 0 else ",").encode("utf-8") + json.dumps(obj, ensure_ascii=False).encode("utf-8")
+            out.write(data)
+            h.update(data)
+            idx += 1
+
+        pending = dict(changed)
+        for obj in iter_stations(f):
+            uuid = obj.get("stationuuid") if isinstance(obj, dict) else None
+            if uuid in deleted:
+                if first_shifted is None:
+                    first_shifted = idx + 1
+                continue
+            if uuid in pending:
+                obj = pending.pop(uuid)
+                updated.append(idx + 1)
+            emit(obj)
+
+        for obj in pending.values():
+            emit(obj)
+        tail = b"]" if idx else b"[]"
+        out.write(tail)
+        h.update(tail)
+
+    os.replace(tmp, dest)
+    with open(dest + ".sha256", "w", encoding="utf-8") as out:
+        out.write(h.hexdigest())
+    return updated, first_shifted, idx
+
+
+def update_files(src: str, updated: list, first_shifted: int, old_total: int, total: int) -> None:
+    """Rewrites only the station files whose content changed."""
+    start = first_shifted or (old_total + 1)
+    indexes = set(i for i in updated if i < start)
+
+    def changed_stations():
+        with open(src, "r", encoding="utf-8") as f:
+            for idx, obj in enumerate(iter_stations(f), start=1):
+                if idx in indexes or idx >= start:
+                    yield idx, obj
+
+    count = 0
+    with ThreadPoolExecutor(max_workers=WRITERS) as pool:
+        for _ in pool.map(lambda item: write_station(*item), changed_stations()):
+            count += 1
+
+    for idx in range(total + 1, old_total + 1):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(f"{OUTPUT_PREFIX}{idx:0{DIGITS}d}.json")
+    print(f"  Rewrote {count} files, removed {max(0, old_total - total)}")
+
+
+def delta_sync(url: str, fmt: str) -> None:
+    if not is_valid(INPUT_FILE):
+        raise Error(f"{INPUT_FILE} is missing or damaged, run a full download first.")
+    state = load_state(STATE_FILE)
+    known = state["stations"]
+    base = api_base(url)
+
+    print(f"Fetching changes from {base} after {state['lastchangeuuid']} ...")
+    changes, last_change = fetch_changes(base, state["lastchangeuuid"])
+
+    stale = [uuid for uuid, change in changes.items() if uuid not in known or known[uuid][0] != change]
+    changed = fetch_stations(base, stale)
+    # changed and deleted since, the change feed still lists them
+    deleted = {uuid for uuid in stale if uuid in known and uuid not in changed}
+
+    inserted = updated = 0
+    for uuid, obj in changed.items():
+        if uuid in known:
+            updated += 1
+            print(f"  ~ {uuid} {obj.get('name', '')!r}")
+        else:
+            inserted += 1
+            print(f"  + {uuid} {obj.get('name', '')!r}")
+
+    hidebroken = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query)).get("hidebroken", "").lower() == "true"
+    expected = catalogue_size(fetch_json(f"{base}/json/stats"), hidebroken)
+    if len(known) + inserted - len(deleted) != expected:
+        print(f"  {len(known) + inserted - len(deleted)} local stations, {expected} in the catalogue, "
+              "looking for deleted ones ...")
+        deleted |= find_deleted(base, [uuid for uuid in known if uuid not in changed and uuid not in deleted])
+    for uuid in sorted(deleted):
+        print(f"  - {uuid}")
+
+    print(f"Inserted: {inserted}, updated: {updated}, deleted: {len(deleted)}")
+    if changed or deleted:
+        positions, first_shifted, total = write_dump(INPUT_FILE, INPUT_FILE, changed, deleted)
+        print(f"Updated {INPUT_FILE}: {total} stations")
+        if fmt == "store":
+            write_store(INPUT_FILE, STORE_FILE)
+        else:
+            update_files(INPUT_FILE, positions, first_shifted, len(known), total)
+    save_state(INPUT_FILE, STATE_FILE, last_change)
     print("Done.")
 
+#######################################
+# Paged fetch: the catalogue in offset/limit pages from several mirrors
+#
+# Every mirror has a few keep-alive connections and a request rate limit.
+# A page that fails on one mirror is retried on the next one, and a
+# failing mirror rests for MIRROR_COOLDOWN seconds. Pages are written in
+# order while the following ones are still being fetched.
+#
+# The mirrors are not snapshots of one catalogue: a station added or
+# deleted between two page requests shifts the offsets, so a station can
+# come twice or not at all. Stations are deduplicated by stationuuid, and
+# /json/stats (working + broken stations) is asked again at the end: when
+# the count has changed or differs from the number of stations, the dump
+# is not accepted.
+
+class Mirror:
+    def __init__(self, base: str, rate: float, connections: int):
+        parts = urllib.parse.urlsplit(base)
+        self.base = base
+        self.https = parts.scheme == "https"
+        self.netloc = parts.netloc
+        self.interval = 1 / rate if rate else 0
+        self.next_time = 0.0
+        self.down_until = 0.0
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(connections)
+        self.pages = 0
+        self.errors = 0
+
+    def available(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def _wait_turn(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def get(self, path: str):
+        """Returns the parsed JSON of path, reusing an idle connection."""
+        with self.slots:
+            self._wait_turn()
+            return self._get(path)
+
+    def _get(self, path: str):
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = cls(self.netloc, timeout=60)
+
+        try:
+            conn.request("GET", path, headers={"User-Agent": USER_AGENT})
+            resp = conn.getresponse()
+            data = resp.read()
+            if resp.status != 200:
+                raise Error(f"{self.base}{path}: HTTP {resp.status}")
+            result = json.loads(data)
+        except BaseException:
+            conn.close()
+            raise
+
+        with self.lock:
+            self.idle.append(conn)
+        return result
+
+    def failed(self) -> None:
+        self.errors += 1
+        self.down_until = time.monotonic() + MIRROR_COOLDOWN
+
+    def close(self) -> None:
+        for conn in self.idle:
+            conn.close()
+
+
+class PagedFetch:
+    def __init__(self, url: str, mirrors: list, page_size: int, rate: float, connections: int):
+        parts = urllib.parse.urlsplit(url)
+        query = [(k, v) for k, v in urllib.parse.parse_qsl(parts.query) if k not in ("offset", "limit")]
+        self.path = parts.path
+        self.query = query
+        self.page_size = page_size
+        self.mirrors = [Mirror(m if "://" in m else f"{parts.scheme}://{m}", rate, connections) for m in mirrors]
+        self.start_count = None
+
+    def page_path(self, n: int) -> str:
+        query = self.query + [("offset", n * self.page_size), ("limit", self.page_size)]
+        return f"{self.path}?{urllib.parse.urlencode(query)}"
+
+    def request(self, path: str, first: int = 0):
+        """Tries the mirrors starting from the first one until one answers."""
+        for attempt in range(MAX_RETRIES + 1):
+            for i in range(len(self.mirrors)):
+                mirror = self.mirrors[(first + i) % len(self.mirrors)]
+                if not mirror.available():
+                    continue
+                try:
+                    result = mirror.get(path)
+                    mirror.pages += 1
+                    return result
+                except (Error, http.client.HTTPException, OSError, ValueError) as err:
+                    mirror.failed()
+                    print(f"\n  {mirror.base}: {err}, trying another mirror")
+            # all mirrors are resting
+            time.sleep(min(2 ** attempt, MIRROR_COOLDOWN))
+        raise Error(f"no mirror could serve {path}")
+
+    def count(self) -> int:
+        hidebroken = dict(self.query).get("hidebroken", "").lower() == "true"
+        return catalogue_size(self.request("/json/stats"), hidebroken)
+
+    def pages(self, workers: int):
+        """Yields the pages in order, fetching up to 2 * workers pages ahead."""
+        self.start_count = self.count()
+        planned = max(1, -(-self.start_count // self.page_size))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = collections.deque()
+            n = 0
+            while True:
+                while n < planned and len(pending) < 2 * workers:
+                    pending.append(pool.submit(self.request, self.page_path(n), n))
+                    n += 1
+                if not pending:
+                    break
+                page = pending.popleft().result()
+                yield page
+
+                if not pending and n == planned and len(page) == self.page_size:
+                    # the catalogue grew since /json/stats, continue page by page
+                    planned += 1
+
+    def close(self) -> None:
+        for mirror in self.mirrors:
+            mirror.close()
+
+
+def paged_download(url: str, dest: str, mirrors: list, page_size: int, rate: float, connections: int) -> None:
+    """Fetches the catalogue in pages and writes it to dest like a single
+    download, with the SHA-256 sidecar."""
+    print(f"Downloading {url} in pages of {page_size} from {len(mirrors)} mirrors ...")
+    fetch = PagedFetch(url, mirrors, page_size, rate, connections)
+    h = hashlib.sha256()
+    total = 0
+    duplicates = 0
+    seen = set()
+    tmp = dest + ".part"
+    try:
+        with open(tmp, "wb") as out:
+            for page in fetch.pages(connections * len(mirrors)):
+                for obj in page:
+                    uuid = obj.get("stationuuid") if isinstance(obj, dict) else None
+                    if uuid:
+                        if uuid in seen:
+                            duplicates += 1
+                            continue
+                        seen.add(uuid)
+                    data = ("[" if total == 0 else ",").encode("utf-8") + json.dumps(obj, ensure_ascii=False).encode("utf-8")
+                    out.write(data)
+                    h.update(data)
+                    total += 1
+                print(f"\r  {total} stations", end="", flush=True)
+            tail = b"]" if total else b"[]"
+            out.write(tail)
+            h.update(tail)
+
+        expected = fetch.count()
+    finally:
+        fetch.close()
+
+    if total != expected or fetch.start_count != expected:
+        os.remove(tmp)
+        raise Error(f"got {total} stations ({duplicates} duplicates dropped), the catalogue had {fetch.start_count} "
+                    f"at the start and {expected} at the end: it changed during the download, try again")
+
+    os.replace(tmp, dest)
+    with open(dest + ".sha256", "w", encoding="utf-8") as out:
+        out.write(h.hexdigest())
+
+    print(f"\nSaved to {dest}, {duplicates} duplicates dropped")
+    for mirror in fetch.mirrors:
+        print(f"  {mirror.base}: {mirror.pages} pages, {mirror.errors} errors")
 
 
 def main():
-    if not os.path.exists(INPUT_FILE):
-        download(API_URL, INPUT_FILE)
-    else:
-        print(f"File {INPUT_FILE!r} already exists, skipping download.")
+    parser = argparse.ArgumentParser(description="Download all RadioBrowser stations and split them into files.")
+    parser.add_argument("--url", default=API_URL,
+                        help=f"catalogue URL (default: {API_URL})")
+    parser.add_argument("--sequential", action="store_true",
+                        help="download the whole dump first, then split it")
+    parser.add_argument("--sha256", metavar="HEX",
+                        help="expected SHA-256 of the dump")
+    parser.add_argument("--format", choices=["files", "store"], default="files",
+                        help=f"files - a JSON file per station, store - one columnar file {STORE_FILE!r} (default: files)")
+    parser.add_argument("--get", metavar="N", type=int,
+                        help="print station N from the columnar store")
+    parser.add_argument("--delta", action="store_true",
+                        help="fetch only the stations changed since the last run and update the local copy")
+    parser.add_argument("--paged", action="store_true",
+                        help="fetch the catalogue in pages from several mirrors at once")
+    parser.add_argument("--mirrors", type=lambda s: [m for m in s.split(",") if m], default=MIRRORS,
+                        help=f"comma-separated mirrors for --paged (default: {','.join(MIRRORS)})")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE,
+                        help=f"stations per page (default: {PAGE_SIZE})")
+    parser.add_argument("--rate", type=float, default=MIRROR_RATE,
+                        help=f"requests per second per mirror, 0 - unlimited (default: {MIRROR_RATE})")
+    parser.add_argument("--connections", type=int, default=MIRROR_CONNECTIONS,
+                        help=f"connections per mirror (default: {MIRROR_CONNECTIONS})")
+    args = parser.parse_args()
+    if args.sha256 and (args.paged or args.delta):
+        parser.error("--sha256 checks a downloaded dump, not one assembled by --paged or --delta")
+
+    try:
+        if args.get is not None:
+            with StationStore(STORE_FILE) as store:
+                print(json.dumps(store[args.get], indent=2, ensure_ascii=False))
+            return
+
+        if args.delta:
+            delta_sync(args.url, args.format)
+            return
+
+        downloaded = not is_valid(INPUT_FILE, args.sha256)
+        if downloaded and args.paged:
+            paged_download(args.url, INPUT_FILE, args.mirrors, args.page_size, args.rate, args.connections)
+
+        if args.format == "store":
+            if not is_valid(INPUT_FILE, args.sha256):
+                download(args.url, INPUT_FILE, args.sha256)
+            write_store(INPUT_FILE, STORE_FILE)
+        elif is_valid(INPUT_FILE, args.sha256):
+            if not downloaded:
+                print(f"File {INPUT_FILE!r} already exists, skipping download.")
+            split(INPUT_FILE)
+        elif args.sequential:
+            download(args.url, INPUT_FILE, args.sha256)
+            split(INPUT_FILE)
+        else:
+            download_and_split(args.url, INPUT_FILE, args.sha256)
 
-    split(INPUT_FILE)
+        # a delta run continues from the saved state, keep it for the same dump
+        if downloaded or not os.path.exists(STATE_FILE):
+            save_state(INPUT_FILE, STATE_FILE)
+    except Error as err:
+        print(f"Error: {err}", file=sys.stderr)
 
 
 
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+"""Finds station "shapes" that the fixtures in this directory don't cover.
+
+A shape is the set of unusual things about a station: null, empty or
+missing fields, values of an unexpected type, dates in odd formats,
+non-ASCII or control characters in the name, unknown codecs and so on.
+The expected types come from the existing fixtures.
+
+The dump is scanned in one streaming pass, only the smallest station of
+every shape is kept. Then a few shapes that cover every new feature are
+picked, and each one is written as the next NNNN_<features>.json fixture.
+"""
+
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import re
+import sys
+
+
+def load_script(name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_").removesuffix(".py"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+dl = load_script("download-all-stations.py")
+
+FIXTURE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_RE = re.compile(r"^(\d{4})_.*\.json$")
+MAX_NAME = 80
+
+KNOWN_CODECS = {"", "MP3", "AAC", "AAC+", "OGG", "FLAC", "OPUS", "UNKNOWN"}
+ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z$")
+DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$")
+DATE_FIELDS = ("lastchangetime", "lastchecktime", "lastcheckoktime", "lastlocalchecktime", "clicktimestamp")
+COUNTERS = ("votes", "bitrate", "clickcount")
+CONTROL_RE = re.compile(r"[\x00-\x1f\x7f]")
+
+
+def type_name(value) -> str:
+    return "bool" if isinstance(value, bool) else type(value).__name__
+
+
+def load_fixtures(path: str) -> list:
+    """Returns (number, station) of every NNNN_*.json fixture."""
+    fixtures = []
+    for file in sorted(glob.glob(os.path.join(path, "*.json"))):
+        m = FIXTURE_RE.match(os.path.basename(file))
+        if m:
+            with open(file, "r", encoding="utf-8") as f:
+                fixtures.append((int(m.group(1)), json.load(f)))
+    return fixtures
+
+
+def make_schema(stations) -> dict:
+    """Returns field -> the type of its first non-null value, or None."""
+    schema = {}
+    for obj in stations:
+        for key, value in obj.items():
+            if schema.get(key) is None:
+                schema[key] = type_name(value) if value is not None else None
+    return schema
+
+
+def features(obj: dict, schema: dict) -> frozenset:
+    """Returns the unusual things about the station."""
+    result = set()
+
+    for key, expected in schema.items():
+        if key not in obj:
+            result.add(f"missing_{key}")
+            continue
+        value = obj[key]
+        if value is None:
+            result.add(f"null_{key}")
+        elif isinstance(value, str) and not value.strip():
+            result.add(f"empty_{key}" if not value else f"blank_{key}")
+        elif expected is None:
+            result.add(f"{type_name(value)}_{key}")
+        elif type_name(value) != expected and not (expected == "float" and type_name(value) == "int"):
+            result.add(f"{type_name(value)}_{key}")
+
+    for key in obj:
+        if key not in schema:
+            result.add(f"extra_{key}")
+
+    for key in DATE_FIELDS:
+        for field, pattern in ((key, DATE_RE), (f"{key}_iso8601", ISO_DATE_RE)):
+            value = obj.get(field)
+            if isinstance(value, str) and value and not pattern.match(value):
+                result.add(f"odd_date_{field}")
+
+    name = obj.get("name")
+    if isinstance(name, str):
+        if CONTROL_RE.search(name):
+            result.add("control_chars_in_name")
+        elif not name.isascii():
+            result.add("non_ascii_name")
+        if name != name.strip():
+            result.add("whitespace_around_name")
+
+    codec = obj.get("codec")
+    if isinstance(codec, str) and codec.upper() not in KNOWN_CODECS:
+        result.add("odd_codec")
+    elif isinstance(codec, str) and codec != codec.upper():
+        result.add("lowercase_codec")
+
+    for key in ("url", "url_resolved"):
+        value = obj.get(key)
+        if isinstance(value, str) and value and not value.lower().startswith(("http://", "https://")):
+            result.add(f"odd_scheme_{key}")
+
+    for key in COUNTERS:
+        value = obj.get(key)
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and value < 0:
+            result.add(f"negative_{key}")
+
+    for key, limit in (("geo_lat", 90), ("geo_long", 180)):
+        value = obj.get(key)
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and abs(value) > limit:
+            result.add(f"out_of_range_{key}")
+
+    return frozenset(result)
+
+
+class Shape:
+    def __init__(self, features: frozenset):
+        self.features = features
+        self.count = 0
+        self.station = None
+        self.size = None
+
+    def add(self, obj: dict) -> None:
+        self.count += 1
+        size = len(json.dumps(obj, ensure_ascii=False))
+        if self.size is None or size < self.size:
+            self.station = obj
+            self.size = size
+
+
+def scan(src: str, schema: dict) -> dict:
+    """Returns features -> Shape for every station in the dump."""
+    shapes = {}
+    total = 0
+    with open(src, "r", encoding="utf-8") as f:
+        for obj in dl.iter_stations(f):
+            if not isinstance(obj, dict):
+                raise dl.Error("stations must be JSON objects.")
+            key = features(obj, schema)
+            shape = shapes.get(key)
+            if shape is None:
+                shape = shapes[key] = Shape(key)
+            shape.add(obj)
+            total += 1
+            if total % 10000 == 0:
+                print(f"\r  Scanned {total}", end="", flush=True)
+
+    print(f"\r  Scanned {total} stations, {len(shapes)} shapes")
+    return shapes
+
+
+def pick(shapes: dict, covered: set) -> list:
+    """Greedily picks shapes until every feature is covered: the shape with
+    the most new features first, the most common one on a tie."""
+    left = set().union(*shapes) - covered
+    picked = []
+    while left:
+        shape = max(shapes.values(), key=lambda s: (len(s.features & left), s.count))
+        picked.append((shape, sorted(shape.features & left)))
+        left -= shape.features
+    return picked
+
+
+def fixture_name(number: int, new: list) -> str:
+    name = ""
+    for feature in new:
+        part = feature if not name else f"{name}_{feature}"
+        if len(part) > MAX_NAME:
+            name += "_etc"
+            break
+        name = part
+    return f"{number:04d}_{name}.json"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write one fixture per new station shape in the RadioBrowser dump.")
+    parser.add_argument("--dump", default=dl.INPUT_FILE,
+                        help=f"the catalogue dump, downloaded when missing (default: {dl.INPUT_FILE})")
+    parser.add_argument("--dir", default=FIXTURE_DIR,
+                        help="the fixture directory (default: the directory of this script)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only print the new shapes")
+    args = parser.parse_args()
+
+    try:
+        if not dl.is_valid(args.dump):
+            dl.download(dl.API_URL, args.dump)
+
+        fixtures = load_fixtures(args.dir)
+        schema = make_schema(obj for _, obj in fixtures)
+        if not schema:
+            raise dl.Error(f"no NNNN_*.json fixtures in {args.dir} to take the field types from.")
+        covered = set().union(*(features(obj, schema) for _, obj in fixtures))
+
+        print(f"Scanning {args.dump} ...")
+        shapes = scan(args.dump, schema)
+        picked = pick(shapes, covered)
+        if not picked:
+            print("The fixtures cover every shape.")
+            return
+
+        number = max(n for n, _ in fixtures)
+        for shape, new in picked:
+            number += 1
+            name = fixture_name(number, new)
+            print(f"  {name}: {shape.count} stations, {shape.size} bytes")
+            if not args.dry_run:
+                with open(os.path.join(args.dir, name), "w", encoding="utf-8") as out:
+                    json.dump(shape.station, out, indent=2, ensure_ascii=False)
+
+        print(f"New shapes: {len(picked)}" + (" (dry run)" if args.dry_run else ""))
+    except dl.Error as err:
+        print(f"Error: {err}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
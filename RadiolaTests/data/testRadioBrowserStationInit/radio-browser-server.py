@@ -0,0 +1,608 @@
+#!/usr/bin/env python3
+
+"""A local stand-in for the RadioBrowser API.
+
+Serves a synthetic catalogue the way download-all-stations.py fetches the
+real one, with the failures of a long download over a bad network:
+
+  GET /json/stations   the whole dump with an ETag, Range and If-Range;
+                       with --drop-after N every response is cut after N bytes
+  GET /json/stations?offset=N&limit=M
+                       a page of the catalogue for --paged
+  GET /json/stats      the number of working and of broken stations
+  GET /json/stations/changed?lastchangeuuid=X&offset=N&limit=M
+                       the history records after change X, without the
+                       check and click fields, like the real change feed
+  POST /json/stations/byuuid
+                       the full stations of the uuids=a,b,... form field
+
+Several servers can share one catalogue and act as mirrors, a mirror
+started with --status 503 fails every request.
+
+    ./radio-browser-server.py --port 8080 --stations 50000 --drop-after 1000000
+    ./download-all-stations.py --url http://localhost:8080/json/stations
+
+With --check it starts the server on a free port and runs the download
+scenarios against it in a temporary directory.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def load_script(name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_").removesuffix(".py"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+dl = load_script("download-all-stations.py")
+
+STATIONS = 1000
+WRITE_SIZE = 16 * 1024
+# the fields of a station history record in /json/stations/changed
+HISTORY_FIELDS = ("changeuuid", "stationuuid", "name", "url", "tags", "countrycode", "votes", "lastchangetime_iso8601")
+
+
+def make_uuid(key: str) -> str:
+    h = hashlib.sha1(key.encode()).hexdigest()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:32]}"
+
+
+class Catalogue:
+    """The stations, with the dump and its ETag rebuilt on every change.
+
+    hooks maps the number of a page request to a change of the stations
+    made just before that page is served, like an edit on the real
+    catalogue in the middle of a paged download. insert(), update() and
+    delete() also keep the history for the change feed.
+    """
+
+    def __init__(self, count: int):
+        self.lock = threading.Lock()
+        self.stations = [self.station(i) for i in range(count)]
+        self.history = [{k: s[k] for k in HISTORY_FIELDS} for s in self.stations]
+        self.page_requests = 0
+        self.hooks = {}
+        self._rebuild()
+
+    @staticmethod
+    def station(i: int) -> dict:
+        return {
+            "changeuuid": make_uuid(f"change {i}"),
+            "stationuuid": make_uuid(str(i)),
+            "name": f"Station {i:06d}",
+            "url": f"http://stream{i % 97}.example.com:8000/radio{i}",
+            "url_resolved": f"http://stream{i % 97}.example.com:8000/radio{i}",
+            "tags": "jazz,blues" if i % 3 else "news",
+            "countrycode": ["DE", "FR", "US", "JP"][i % 4],
+            "codec": "MP3",
+            "bitrate": 128,
+            "votes": i % 1000,
+            "lastcheckok": 0 if i % 50 == 0 else 1,
+            "lastchangetime_iso8601": "2026-01-01T00:00:00Z",
+        }
+
+    def _rebuild(self) -> None:
+        self.dump = json.dumps(self.stations, ensure_ascii=False).encode("utf-8")
+        self.etag = f'"{hashlib.sha1(self.dump).hexdigest()}"'
+
+    def change(self, fn) -> None:
+        """Calls fn with the list of stations to edit it in place."""
+        with self.lock:
+            fn(self.stations)
+            self._rebuild()
+
+    def _record(self, station: dict) -> None:
+        n = len(self.history)
+        station["changeuuid"] = make_uuid(f"change {n}")
+        station["lastchangetime_iso8601"] = f"2026-01-02T{n // 3600 % 24:02d}:{n // 60 % 60:02d}:{n % 60:02d}Z"
+        self.history.append({k: station[k] for k in HISTORY_FIELDS})
+
+    def insert(self) -> dict:
+        with self.lock:
+            station = self.station(len(self.history))
+            self._record(station)
+            self.stations.append(station)
+            self._rebuild()
+            return station
+
+    def update(self, i: int, **fields) -> None:
+        with self.lock:
+            self.stations[i].update(fields)
+            self._record(self.stations[i])
+            self._rebuild()
+
+    def delete(self, i: int) -> dict:
+        """Deleted stations leave no record in the change feed."""
+        with self.lock:
+            station = self.stations.pop(i)
+            self._rebuild()
+            return station
+
+    def changes(self, last_change: str, offset: int, limit: int) -> list:
+        with self.lock:
+            start = next((n + 1 for n, h in enumerate(self.history) if h["changeuuid"] == last_change), 0)
+            return self.history[start + offset:start + offset + limit]
+
+    def by_uuid(self, uuids: list) -> list:
+        with self.lock:
+            wanted = set(uuids)
+            return [s for s in self.stations if s["stationuuid"] in wanted]
+
+    def page(self, offset: int, limit: int, hidebroken: bool = False) -> bytes:
+        with self.lock:
+            self.page_requests += 1
+            hook = self.hooks.pop(self.page_requests, None)
+            if hook:
+                hook(self.stations)
+                self._rebuild()
+            stations = [s for s in self.stations if s["lastcheckok"]] if hidebroken else self.stations
+            return json.dumps(stations[offset:offset + limit], ensure_ascii=False).encode("utf-8")
+
+    def stats(self) -> dict:
+        """Like the real API, the broken stations are not in "stations"."""
+        with self.lock:
+            broken = sum(not s["lastcheckok"] for s in self.stations)
+            return {"stations": len(self.stations) - broken, "stations_broken": broken}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parts = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(parts.query))
+        if self.server.status != 200:
+            self.send_body(self.server.status, b"unavailable", "text/plain")
+        elif parts.path == "/json/stats":
+            self.send_body(200, json.dumps(self.server.catalogue.stats()).encode(), "application/json")
+        elif parts.path == "/json/stations/changed":
+            changes = self.server.catalogue.changes(query.get("lastchangeuuid", ""), int(query.get("offset", 0)),
+                                                    int(query.get("limit", 100000)))
+            self.send_body(200, json.dumps(changes).encode(), "application/json")
+        elif parts.path == "/json/stations/byuuid":
+            self.send_by_uuid(query.get("uuids", ""))
+        elif parts.path == "/json/stations" and "offset" in query:
+            page = self.server.catalogue.page(int(query["offset"]), int(query.get("limit", 100000)),
+                                              query.get("hidebroken") == "true")
+            self.send_body(200, page, "application/json")
+        elif parts.path == "/json/stations":
+            self.send_dump()
+        else:
+            self.send_body(404, b"not found", "text/plain")
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+        if self.server.status != 200:
+            self.send_body(self.server.status, b"unavailable", "text/plain")
+        elif self.path == "/json/stations/byuuid":
+            self.send_by_uuid(dict(urllib.parse.parse_qsl(data)).get("uuids", ""))
+        else:
+            self.send_body(404, b"not found", "text/plain")
+
+    def send_by_uuid(self, uuids: str):
+        stations = self.server.catalogue.by_uuid([u for u in uuids.split(",") if u])
+        self.send_body(200, json.dumps(stations, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def send_body(self, status: int, body: bytes, content_type: str, headers: dict = None, drop: bool = False):
+        # logged before the client can see the response
+        self.server.log.append((self.path, self.headers.get("Range"), status))
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        drop_after = self.server.drop_after if drop else None
+        if drop and self.server.drop_first:
+            self.server.drop_first -= 1
+            drop_after = -1
+        sent = 0
+        while sent < len(body):
+            n = min(WRITE_SIZE, len(body) - sent)
+            if drop_after is not None:
+                n = min(n, drop_after - sent)
+                if n <= 0:
+                    # cut the connection in the middle of the body
+                    self.wfile.flush()
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    self.close_connection = True
+                    return
+            self.wfile.write(body[sent:sent + n])
+            sent += n
+
+    def send_dump(self):
+        with self.server.catalogue.lock:
+            dump, etag = self.server.catalogue.dump, self.server.catalogue.etag
+
+        range_header = self.headers.get("Range", "")
+        if_range = self.headers.get("If-Range")
+        start = None
+        if range_header.startswith("bytes=") and range_header.endswith("-") and if_range in (None, etag):
+            start = int(range_header[6:-1])
+
+        if start is None:
+            self.send_body(200, dump, "application/json", {"ETag": etag}, drop=True)
+        elif start >= len(dump):
+            self.send_body(416, b"", "text/plain", {"Content-Range": f"bytes */{len(dump)}"})
+        else:
+            self.send_body(206, dump[start:], "application/json", {
+                "ETag": etag,
+                "Content-Range": f"bytes {start}-{len(dump) - 1}/{len(dump)}",
+            }, drop=True)
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str, port: int, stations: int = STATIONS, drop_after: int = None,
+                 status: int = 200, catalogue: Catalogue = None, drop_first: int = 0):
+        super().__init__((host, port), Handler)
+        self.catalogue = catalogue or Catalogue(stations)
+        self.drop_after = drop_after
+        self.status = status
+        self.drop_first = drop_first    # responses cut right after the headers
+        self.log = []       # (path, Range, status) of every response
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "Server":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+#######################################
+# Check
+
+@contextlib.contextmanager
+def max_retries(n: int):
+    saved = dl.MAX_RETRIES
+    dl.MAX_RETRIES = n
+    try:
+        yield
+    finally:
+        dl.MAX_RETRIES = saved
+
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def interrupt(server: Server, url: str, dest: str) -> None:
+    """Leaves dest.part behind like a run killed after the first drop."""
+    with max_retries(0):
+        try:
+            dl.download(url, dest)
+        except dl.Error:
+            pass
+    if not os.path.exists(dest + ".part"):
+        raise dl.Error("no .part file after an interrupted download")
+    # the app tests read every *.json next to the script as a station
+    left = [f for f in os.listdir(".") if f.endswith(".json")]
+    if left:
+        raise dl.Error(f"an interrupted download left {left}")
+
+
+def check_drops(server: Server) -> None:
+    """Every response is cut, the download resumes with Range requests."""
+    url = server.url + "/json/stations"
+    dl.download(url, "dump.json")
+    if read("dump.json") != server.catalogue.dump or not dl.is_valid("dump.json"):
+        raise dl.Error("the dump differs from the served one")
+    resumed = [s for _, r, s in server.log if r and s == 206]
+    if len(resumed) < 2:
+        raise dl.Error(f"expected resumed requests, the log is {server.log}")
+
+
+def check_drop_at_start(server: Server) -> None:
+    """A response cut before the first byte is just started again."""
+    url = server.url + "/json/stations"
+    dl.download(url, "dump.json")
+    if read("dump.json") != server.catalogue.dump:
+        raise dl.Error("the dump differs from the served one")
+    if [s for _, _, s in server.log] != [200, 200]:
+        raise dl.Error(f"expected two full requests, the log is {server.log}")
+    if sorted(os.listdir(".")) != ["dump.json", "dump.json.sha256"]:
+        raise dl.Error(f"files left behind: {sorted(os.listdir('.'))}")
+
+
+def check_next_run(server: Server) -> None:
+    """An interrupted run leaves a part, the next one continues it."""
+    url = server.url + "/json/stations"
+    interrupt(server, url, "dump.json")
+    size = os.path.getsize("dump.json.part")
+    server.drop_after = None
+    server.log.clear()
+    dl.download(url, "dump.json")
+    if read("dump.json") != server.catalogue.dump:
+        raise dl.Error("the dump differs from the served one")
+    if server.log != [(url[len(server.url):], f"bytes={size}-", 206)]:
+        raise dl.Error(f"expected one request from {size}, the log is {server.log}")
+
+
+def check_changed(server: Server) -> None:
+    """The dump changed between runs, the old part is not reused."""
+    url = server.url + "/json/stations"
+    interrupt(server, url, "dump.json")
+    server.catalogue.change(lambda stations: stations[0].update(name="Renamed"))
+    server.drop_after = None
+    server.log.clear()
+    dl.download(url, "dump.json")
+    if read("dump.json") != server.catalogue.dump:
+        raise dl.Error("the dump is not the changed one")
+    if [s for _, _, s in server.log] != [200]:
+        raise dl.Error(f"expected a fresh download, the log is {server.log}")
+
+
+def check_complete_part(server: Server) -> None:
+    """A part with the whole body is finished without downloading it again."""
+    url = server.url + "/json/stations"
+    with open("dump.json.part", "wb") as f:
+        f.write(server.catalogue.dump)
+    with open("dump.json.part.meta", "w", encoding="utf-8") as f:
+        json.dump({"url": url, "etag": server.catalogue.etag}, f)
+    dl.download(url, "dump.json")
+    if read("dump.json") != server.catalogue.dump or not dl.is_valid("dump.json"):
+        raise dl.Error("the dump differs from the served one")
+    if [s for _, _, s in server.log] != [416]:
+        raise dl.Error(f"expected 416, the log is {server.log}")
+
+
+def check_sha256(server: Server) -> None:
+    """A wrong --sha256 fails and leaves nothing to resume."""
+    try:
+        dl.download(server.url + "/json/stations", "dump.json", "0" * 64)
+    except dl.Error:
+        pass
+    else:
+        raise dl.Error("no SHA-256 mismatch")
+    if os.path.exists("dump.json") or os.path.exists("dump.json.part"):
+        raise dl.Error("the wrong dump was kept")
+
+
+def check_split(server: Server) -> None:
+    """Downloading and splitting at once survives the drops too."""
+    dl.download_and_split(server.url + "/json/stations", dl.INPUT_FILE)
+    files = sorted(f for f in os.listdir(".") if f.startswith(dl.OUTPUT_PREFIX))
+    if len(files) != len(server.catalogue.stations):
+        raise dl.Error(f"{len(files)} files for {len(server.catalogue.stations)} stations")
+    with open(files[-1], "r", encoding="utf-8") as f:
+        if json.load(f) != server.catalogue.stations[-1]:
+            raise dl.Error(f"{files[-1]} differs from the last station")
+
+
+def check_iter_stations(server: Server) -> None:
+    """Every element is parsed the same wherever the chunks are cut."""
+    text = ('[-1.5, 1e5, -2E-3, 10, 0.25, "a,b]", {"stationuuid": "x", "n": [1, 2.5e1]}, '
+            'true, null, [], "http://example.com/;", 123456789, -0.0]')
+    expected = json.loads(text)
+    for chunk_size in range(1, len(text) + 1):
+        got = list(dl.iter_stations(io.StringIO(text), chunk_size))
+        if got != expected:
+            raise dl.Error(f"chunk size {chunk_size}: {got}")
+
+
+def check_delta(server: Server) -> None:
+    """An insert, an update, an update then a delete and a delete are
+    applied to the dump and the files with full records; a run without
+    deletions looks up only the changed stations."""
+    url = server.url + "/json/stations"
+    catalogue = server.catalogue
+    dl.download_and_split(url, dl.INPUT_FILE)
+    dl.save_state(dl.INPUT_FILE, dl.STATE_FILE)
+
+    catalogue.insert()
+    catalogue.update(5, name="Renamed", votes=12345)
+    catalogue.update(20, name="Renamed, then deleted")
+    catalogue.delete(20)
+    catalogue.delete(30)
+    dl.delta_sync(url, "files")
+
+    with open(dl.INPUT_FILE, "r", encoding="utf-8") as f:
+        if json.load(f) != catalogue.stations:
+            raise dl.Error("the dump differs from the catalogue")
+    files = sorted(f for f in os.listdir(".") if f.startswith(dl.OUTPUT_PREFIX))
+    if len(files) != len(catalogue.stations):
+        raise dl.Error(f"{len(files)} files for {len(catalogue.stations)} stations")
+    for n in (5, 20, len(catalogue.stations) - 1):
+        with open(files[n], "r", encoding="utf-8") as f:
+            if json.load(f) != catalogue.stations[n]:
+                raise dl.Error(f"{files[n]} differs from station {n}")
+
+    catalogue.update(7, name="Renamed again")
+    server.log.clear()
+    dl.delta_sync(url, "files")
+    lookups = [path for path, _, _ in server.log if path.startswith("/json/stations/byuuid")]
+    if len(lookups) != 1:
+        raise dl.Error(f"expected one lookup of the changed station, the log is {server.log}")
+    with open(files[7], "r", encoding="utf-8") as f:
+        if json.load(f) != catalogue.stations[7]:
+            raise dl.Error(f"{files[7]} differs from station 7")
+
+
+def refused_url() -> str:
+    """A port nobody listens on."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}"
+
+
+def paged(server: Server, mirrors: list, query: str = "") -> None:
+    dl.paged_download(server.url + "/json/stations" + query, "dump.json", mirrors, 100, 0, 1)
+
+
+def check_paged(server: Server) -> None:
+    """Pages from a healthy mirror, a failing one and a dead one make the dump."""
+    failing = Server("127.0.0.1", 0, status=503, catalogue=server.catalogue).start()
+    try:
+        paged(server, [failing.url, refused_url(), server.url])
+    finally:
+        failing.stop()
+    with open("dump.json", "r", encoding="utf-8") as f:
+        if json.load(f) != server.catalogue.stations or not dl.is_valid("dump.json"):
+            raise dl.Error("the dump differs from the served one")
+    if not failing.log:
+        raise dl.Error("the failing mirror was never asked")
+
+
+def check_paged_hidebroken(server: Server) -> None:
+    """Without the broken stations the count is the working ones only."""
+    paged(server, [server.url], "?hidebroken=true")
+    with open("dump.json", "r", encoding="utf-8") as f:
+        if json.load(f) != [s for s in server.catalogue.stations if s["lastcheckok"]]:
+            raise dl.Error("the dump differs from the working stations")
+
+
+def check_sha256_given(server: Server) -> None:
+    """An existing dump with another hash is not reused, --paged can't be checked."""
+    dl.download(server.url + "/json/stations", "dump.json")
+    with open("dump.json.sha256", "r", encoding="utf-8") as f:
+        digest = f.read().strip()
+    if not dl.is_valid("dump.json", digest.upper()) or dl.is_valid("dump.json", "0" * 64):
+        raise dl.Error("is_valid ignores the expected SHA-256")
+
+    argv = sys.argv
+    sys.argv = ["download-all-stations.py", "--paged", "--sha256", digest]
+    try:
+        with contextlib.redirect_stderr(io.StringIO()):
+            dl.main()
+    except SystemExit:
+        pass
+    else:
+        raise dl.Error("--paged with --sha256 was accepted")
+    finally:
+        sys.argv = argv
+
+
+def check_paged_change(change):
+    """The catalogue changes after the fifth page, the dump must be rejected."""
+    def check(server: Server) -> None:
+        server.catalogue.hooks[5] = change
+        try:
+            paged(server, [server.url])
+        except dl.Error as err:
+            print(f"Error: {err}")
+        else:
+            raise dl.Error("a changed catalogue was accepted")
+        if os.path.exists("dump.json") or os.path.exists("dump.json.part"):
+            raise dl.Error("the dump of a changed catalogue was kept")
+    check.__name__ = "check_paged_" + change.__name__
+    return check
+
+
+def insert_first(stations: list) -> None:
+    """A station added before the offset, a page repeats a station."""
+    stations.insert(0, dict(Catalogue.station(len(stations)), name="A new station"))
+
+
+def delete_first(stations: list) -> None:
+    """A station deleted before the offset, a page skips a station."""
+    del stations[0]
+
+
+def move_last_first(stations: list) -> None:
+    """A renamed station moves before the offset, the count stays the same."""
+    stations.insert(0, dict(stations.pop(-1), name="A renamed station"))
+
+
+CHECKS = [
+    (check_iter_stations, {"stations": 0}),
+    (check_drops, {"drop_after": 150_000}),
+    (check_drop_at_start, {"drop_first": 1}),
+    (check_next_run, {"drop_after": 150_000}),
+    (check_changed, {"drop_after": 150_000}),
+    (check_complete_part, {}),
+    (check_sha256, {}),
+    (check_split, {"drop_after": 150_000}),
+    (check_delta, {}),
+    (check_paged, {}),
+    (check_paged_hidebroken, {}),
+    (check_sha256_given, {}),
+    (check_paged_change(insert_first), {}),
+    (check_paged_change(delete_first), {}),
+    (check_paged_change(move_last_first), {}),
+]
+
+
+def run_checks() -> int:
+    """Runs every check against a fresh server in a fresh directory.
+    Returns the number of failures."""
+    failed = 0
+    cwd = os.getcwd()
+    for check, options in CHECKS:
+        server = Server("127.0.0.1", 0, **options).start()
+        output = io.StringIO()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                with contextlib.redirect_stdout(output):
+                    check(server)
+                error = None
+            except dl.Error as err:
+                error = err
+            finally:
+                os.chdir(cwd)
+                server.stop()
+
+        name = check.__name__.removeprefix("check_")
+        if error:
+            failed += 1
+            print(f"FAIL {name}: {error}")
+            print(output.getvalue())
+        else:
+            print(f"OK   {name}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="A local stand-in for the RadioBrowser API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--stations", type=int, default=STATIONS,
+                        help=f"stations in the catalogue (default: {STATIONS})")
+    parser.add_argument("--drop-after", metavar="BYTES", type=int,
+                        help="close the connection after BYTES of every dump response")
+    parser.add_argument("--status", type=int, default=200,
+                        help="answer every request with this HTTP status, for a failing mirror (default: 200)")
+    parser.add_argument("--check", action="store_true",
+                        help="run the download scenarios against a local server")
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(1 if run_checks() else 0)
+
+    server = Server(args.host, args.port, args.stations, args.drop_after, args.status)
+    print(f"Serving {args.stations} stations on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+"""Search index over the RadioBrowser dump for offline query benchmarks.
+
+    ./station-index.py build
+    ./station-index.py query --name "jazz" --country DE --bitrate-min 128
+    ./station-index.py bench queries.jsonl
+
+The index keeps:
+  * posting lists (sorted station numbers) for tags, name words,
+    countries and codecs;
+  * station numbers sorted by votes and by bitrate for range queries;
+  * posting lists for every trigram of the lowercased name, so a substring
+    search only checks the stations that have all its trigrams.
+
+A query starts from its most selective condition and checks the others on
+the candidates only. When even that condition matches a large part of the
+catalogue, the stations are walked from the most voted one instead, until
+the limit is reached.
+"""
+
+import argparse
+import bisect
+import heapq
+import importlib.util
+import itertools
+import json
+import os
+import pickle
+import random
+import re
+import sys
+import time
+from array import array
+
+
+def load_script(name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_").removesuffix(".py"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+dl = load_script("download-all-stations.py")
+
+INDEX_FILE = "radio-browser.stations.index.tmp"
+WORD_RE = re.compile(r"\w+")
+BROAD_QUERY = 16         # walk by votes when the best condition matches over 1/16 of stations
+QUERY_FIELDS = ("name", "words", "tag", "country", "codec", "bitrate_min", "bitrate_max", "votes_min")
+
+
+def words(text: str) -> set:
+    return set(WORD_RE.findall(text.lower()))
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def as_int(value) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class Index:
+    def __init__(self):
+        self.uuids = []
+        self.names = []          # lowercased
+        self.votes = array("q")
+        self.bitrates = array("q")
+        self.tags = {}
+        self.words = {}
+        self.countries = {}
+        self.codecs = {}
+        self.trigrams = {}
+        self.by_votes = array("I")
+        self.by_bitrate = array("I")
+
+    @classmethod
+    def build(cls, src: str) -> "Index":
+        index = cls()
+        with open(src, "r", encoding="utf-8") as f:
+            # the numbers are of the indexed stations, the elements that are not objects are skipped
+            stations = (obj for obj in dl.iter_stations(f) if isinstance(obj, dict))
+            for n, obj in enumerate(stations):
+                index._add(n, obj)
+                if (n + 1) % 10000 == 0:
+                    print(f"\r  Indexed {n + 1}", end="", flush=True)
+
+        # the postings are appended in station order, so they are sorted already;
+        # equal votes: the lower station number last, so the reversed order matches search()
+        index.by_votes = array("I", sorted(range(len(index.uuids)), key=lambda n: (index.votes[n], -n)))
+        index.by_bitrate = array("I", sorted(range(len(index.uuids)), key=index.bitrates.__getitem__))
+        print(f"\r  Indexed {len(index.uuids)} stations, {len(index.tags)} tags, "
+              f"{len(index.words)} words, {len(index.trigrams)} trigrams")
+        return index
+
+    def _add(self, n: int, obj: dict) -> None:
+        name = (obj.get("name") or "").lower()
+        self.uuids.append(obj.get("stationuuid"))
+        self.names.append(name)
+        self.votes.append(as_int(obj.get("votes")))
+        self.bitrates.append(as_int(obj.get("bitrate")))
+
+        tags = {t.strip() for t in (obj.get("tags") or "").lower().split(",") if t.strip()}
+        countries = {c.lower() for c in (obj.get("countrycode"), obj.get("country")) if c}
+        codec = (obj.get("codec") or "").lower()
+
+        for table, keys in ((self.tags, tags), (self.words, words(name)), (self.countries, countries),
+                            (self.codecs, {codec} if codec else ()), (self.trigrams, trigrams(name))):
+            for key in keys:
+                posting = table.get(key)
+                if posting is None:
+                    posting = table[key] = array("I")
+                posting.append(n)
+
+    def save(self, path: str) -> None:
+        tmp = path + ".part"
+        with open(tmp, "wb") as out:
+            pickle.dump(self.__dict__, out, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Index":
+        index = cls()
+        try:
+            with open(path, "rb") as f:
+                index.__dict__.update(pickle.load(f))
+        except (OSError, pickle.UnpicklingError, EOFError) as err:
+            raise dl.Error(f"can't read {path}, run 'build' first: {err}")
+        return index
+
+    def __len__(self) -> int:
+        return len(self.uuids)
+
+    def _conditions(self, query: dict) -> list:
+        """Returns (size, candidates, test) for every condition of the query.
+        candidates() lists the matching station numbers, test(n) checks one."""
+        conditions = []
+        empty = array("I")
+
+        def posting(table, key):
+            p = table.get(key, empty)
+            return (len(p), lambda: p, lambda n: contains(p, n))
+
+        def value_range(values, order, lo, hi):
+            lo = -2 ** 63 if lo is None else lo
+            hi = 2 ** 63 - 1 if hi is None else hi
+            key = values.__getitem__
+            start = bisect.bisect_left(order, lo, key=key)
+            end = bisect.bisect_right(order, hi, key=key)
+            return (end - start, lambda: sorted(order[start:end]), lambda n: lo <= values[n] <= hi)
+
+        if query.get("tag"):
+            conditions.append(posting(self.tags, query["tag"].lower()))
+        for word in words(query.get("words") or ""):
+            conditions.append(posting(self.words, word))
+        if query.get("country"):
+            conditions.append(posting(self.countries, query["country"].lower()))
+        if query.get("codec"):
+            conditions.append(posting(self.codecs, query["codec"].lower()))
+
+        name = (query.get("name") or "").lower()
+        if name:
+            grams = trigrams(name)
+            names = self.names
+            if grams:
+                # the rarest trigrams narrow the candidates, the name check confirms them
+                postings = sorted((self.trigrams.get(g, empty) for g in grams), key=len)
+                conditions.append((len(postings[0]),
+                                   lambda: [n for n in intersect(postings) if name in names[n]],
+                                   lambda n: name in names[n]))
+            else:
+                conditions.append((len(names),
+                                   lambda: [n for n, s in enumerate(names) if name in s],
+                                   lambda n: name in names[n]))
+
+        if query.get("bitrate_min") is not None or query.get("bitrate_max") is not None:
+            conditions.append(value_range(self.bitrates, self.by_bitrate, query.get("bitrate_min"), query.get("bitrate_max")))
+        if query.get("votes_min") is not None:
+            conditions.append(value_range(self.votes, self.by_votes, query["votes_min"], None))
+
+        return conditions
+
+    def search(self, query: dict, limit: int = 100, order: str = "votes") -> list:
+        """Returns the station numbers that match every condition of the
+        query, the most voted first, or in catalogue order."""
+        conditions = sorted(self._conditions(query), key=lambda c: c[0])
+        if order == "votes" and (not conditions or conditions[0][0] > len(self) // BROAD_QUERY):
+            tests = [test for _, _, test in conditions]
+            matches = (n for n in reversed(self.by_votes) if all(test(n) for test in tests))
+            return list(itertools.islice(matches, limit))
+
+        if conditions:
+            _, candidates, _ = conditions[0]
+            tests = [test for _, _, test in conditions[1:]]
+            matches = (n for n in candidates() if all(test(n) for test in tests))
+        else:
+            matches = iter(range(len(self)))
+
+        if order == "votes":
+            return heapq.nsmallest(limit, matches, key=lambda n: (-self.votes[n], n))
+        return list(itertools.islice(matches, limit))
+
+    def scan(self, query: dict, limit: int = 100, order: str = "votes") -> list:
+        """The same as search() without the indexes, to check the results."""
+        conditions = self._conditions(query)
+        matches = (n for n in range(len(self)) if all(test(n) for _, _, test in conditions))
+        if order == "votes":
+            return heapq.nsmallest(limit, matches, key=lambda n: (-self.votes[n], n))
+        return list(itertools.islice(matches, limit))
+
+
+def contains(posting, n: int) -> bool:
+    i = bisect.bisect_left(posting, n)
+    return i < len(posting) and posting[i] == n
+
+
+def intersect(postings: list) -> list:
+    """Intersects sorted postings, the shortest one first."""
+    result = postings[0]
+    for p in postings[1:]:
+        if len(p) > 8 * len(result):
+            result = [n for n in result if contains(p, n)]
+        else:
+            result = sorted(set(result).intersection(p))
+        if not result:
+            break
+    return result
+
+
+#######################################
+# Commands
+
+def make_log(index: Index, count: int, seed: int = 1) -> list:
+    """Makes a query log that resembles user searches over the catalogue."""
+    rnd = random.Random(seed)
+    tags = sorted(index.tags, key=lambda t: -len(index.tags[t]))[:500]
+    countries = sorted(index.countries)
+    codecs = sorted(index.codecs)
+    queries = []
+    for _ in range(count):
+        query = {}
+        kind = rnd.random()
+        if kind < 0.5:
+            name = rnd.choice(index.names) or "radio"
+            start = rnd.randrange(max(1, len(name) - 3))
+            query["name"] = name[start:start + rnd.randint(3, 8)]
+        elif kind < 0.8 and tags:
+            query["tag"] = rnd.choice(tags)
+        elif index.words:
+            query["words"] = rnd.choice(index.names).split(" ")[0] or "radio"
+        if countries and rnd.random() < 0.3:
+            query["country"] = rnd.choice(countries)
+        if codecs and rnd.random() < 0.2:
+            query["codec"] = rnd.choice(codecs)
+        if rnd.random() < 0.2:
+            query["bitrate_min"] = rnd.choice((64, 96, 128, 192))
+        if rnd.random() < 0.05:
+            query["bitrate_max"] = rnd.choice((64, 128, 320))
+        queries.append(query)
+    return queries
+
+
+def load_log(path: str) -> list:
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                obj = json.loads(line)
+                queries.append({k: obj[k] for k in QUERY_FIELDS if obj.get(k) not in (None, "")})
+    return queries
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] if values else float("nan")
+
+
+def bench(index: Index, queries: list, limit: int, check: bool) -> None:
+    latencies = []
+    found = 0
+    for query in queries:
+        start = time.perf_counter()
+        result = index.search(query, limit)
+        latencies.append(time.perf_counter() - start)
+        found += len(result)
+        if check and result != index.scan(query, limit):
+            raise dl.Error(f"the index and the scan disagree on {query}")
+
+    print(f"Stations:  {len(index)}")
+    print(f"Queries:   {len(queries)}, {found / max(1, len(queries)):.1f} results on average")
+    print(f"Latency:   p50 {percentile(latencies, 50) * 1e6:.0f} us, p99 {percentile(latencies, 99) * 1e6:.0f} us, "
+          f"max {max(latencies, default=float('nan')) * 1e6:.0f} us")
+    print(f"Total:     {sum(latencies):.3f} s")
+    if check:
+        print("Check:     the results equal a full scan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search index over the RadioBrowser dump.")
+    parser.add_argument("--index", default=INDEX_FILE, help=f"index file (default: {INDEX_FILE})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="index the dump")
+    build.add_argument("--dump", default=dl.INPUT_FILE, help=f"the catalogue dump (default: {dl.INPUT_FILE})")
+
+    query = commands.add_parser("query", help="run one query")
+    for field in QUERY_FIELDS:
+        query.add_argument("--" + field.replace("_", "-"), type=int if field.endswith(("_min", "_max")) else str)
+    query.add_argument("--limit", type=int, default=20)
+
+    bench_cmd = commands.add_parser("bench", help="replay a query log, JSON lines with the query fields")
+    bench_cmd.add_argument("log", nargs="?", help="the query log")
+    bench_cmd.add_argument("--make-log", metavar="N", type=int,
+                           help="write N synthetic queries to the log file and replay them")
+    bench_cmd.add_argument("--limit", type=int, default=100)
+    bench_cmd.add_argument("--check", action="store_true", help="compare every result with a full scan")
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == "build":
+            if not dl.is_valid(args.dump):
+                dl.download(dl.API_URL, args.dump)
+            print(f"Indexing {args.dump} ...")
+            start = time.perf_counter()
+            index = Index.build(args.dump)
+            index.save(args.index)
+            print(f"Saved to {args.index} in {time.perf_counter() - start:.1f} s")
+            return
+
+        index = Index.load(args.index)
+
+        if args.command == "query":
+            q = {k: getattr(args, k) for k in QUERY_FIELDS if getattr(args, k) is not None}
+            for n in index.search(q, args.limit):
+                print(f"{index.uuids[n]}  {index.votes[n]:>6}  {index.bitrates[n]:>4}  {index.names[n]}")
+            return
+
+        if args.make_log:
+            queries = make_log(index, args.make_log)
+            if args.log:
+                with open(args.log, "w", encoding="utf-8") as out:
+                    for q in queries:
+                        out.write(json.dumps(q, ensure_ascii=False) + "\n")
+        elif args.log:
+            queries = load_log(args.log)
+        else:
+            raise dl.Error("give a query log or --make-log N.")
+        bench(index, queries, args.limit, args.check)
+    except (dl.Error, OSError, ValueError) as err:
+        print(f"Error: {err}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+""" A local stand-in for the GitHub releases API, for update-feed.py.
+
+    Serves a synthetic list of releases the way GitHub does: pages of at
+    most 100 releases with Link headers, an ETag on every page and 304 for
+    a matching If-None-Match. The assets without a size answer HEAD with
+    their Content-Length.
+
+        ./github-api.py --port 8765 --releases 250
+        ./update-feed.py --api http://127.0.0.1:8765
+
+    With --check it runs update-feed.py against the stand-in in a temporary
+    directory: the first run, a run without changes, an edited old release,
+    a new release, --full, changed output options and two betas of one
+    version. """
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GITHUB_USER = "SokoloffA"
+GITHUB_REPO = "radiola"
+RELEASES = 250
+PER_PAGE_MAX = 100   # GitHub cuts a bigger per_page to 100
+UPDATE_FEED = os.path.join(os.path.dirname(os.path.abspath(__file__)), "update-feed.py")
+
+
+def makeRelease(n, base, beta=None):
+    """ Release n, the higher n the newer. Every 7th is a beta 1 unless
+        beta is given, every 10th asset has no size in the API. """
+    version = f"3.{n // 100}.{n % 100}"
+    if beta is None:
+        beta = 1 if n % 7 == 0 else 0
+    tag = f"v{version}" + (f"-beta{beta}" if beta else "")
+    published = datetime.datetime(2020, 1, 1) + datetime.timedelta(hours=n)
+    return {
+        "tag_name": tag,
+        "prerelease": bool(beta),
+        "body": f"* Change of {tag} with `code` & <b>markup</b>\n* Another change",
+        "published_at": published.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "assets": [{
+            "browser_download_url": f"{base}/dl/{tag}/Radiola-{version}.dmg",
+            "size": 0 if n % 10 == 0 else 1000000 + n,
+        }],
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status, headers, body=b""):
+        # logged before the client can see the response
+        self.server.log.append((self.command, self.path, status))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        m = re.match(r"/dl/[^/]+/Radiola-3\.(\d+)\.(\d+)\.dmg$", self.path)
+        if not m:
+            self.respond(404, {})
+            return
+        self.server.log.append((self.command, self.path, 200))
+        self.send_response(200)
+        self.send_header("Content-Length", str(2000000 + int(m.group(1)) * 100 + int(m.group(2))))
+        self.end_headers()
+
+    def do_GET(self):
+        parts = urllib.parse.urlsplit(self.path)
+        if parts.path != f"/repos/{GITHUB_USER}/{GITHUB_REPO}/releases":
+            self.respond(404, {}, b'{"message": "Not Found"}')
+            return
+
+        query = urllib.parse.parse_qs(parts.query)
+        perPage = min(int(query.get("per_page", ["30"])[0]), PER_PAGE_MAX)
+        page = int(query.get("page", ["1"])[0])
+        with self.server.lock:
+            releases = self.server.releases[(page - 1) * perPage:page * perPage]
+            last = max(1, -(-len(self.server.releases) // perPage))
+
+        body = json.dumps(releases).encode("utf-8")
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            self.respond(304, {"ETag": etag})
+            return
+
+        url = f"{self.server.url}{parts.path}?per_page={perPage}&page=%d"
+        links = []
+        if page < last:
+            links.append(f'<{url % (page + 1)}>; rel="next"')
+        links.append(f'<{url % last}>; rel="last"')
+        self.respond(200, {"Content-Type": "application/json", "ETag": etag, "Link": ", ".join(links)}, body)
+
+
+class Api(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host, port, releases=RELEASES):
+        super().__init__((host, port), Handler)
+        self.url = f"http://{host}:{self.server_address[1]}"
+        self.lock = threading.Lock()
+        self.releases = [makeRelease(n, self.url) for n in range(releases, 0, -1)]
+        self.log = []    # (method, path, status) of every request
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+#######################################
+# Check
+
+def runFeed(api, dir, *args):
+    """ Runs update-feed.py in dir, returns its stdout + stderr. """
+    api.log.clear()
+    p = subprocess.run([sys.executable, UPDATE_FEED, "--api", api.url] + list(args),
+                       cwd=dir, capture_output=True, text=True)
+    return p.stdout + p.stderr
+
+
+def readFeed(dir, file="feed-beta.xml"):
+    with open(os.path.join(dir, file), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def statuses(api):
+    return sorted(status for method, path, status in api.log if method == "GET")
+
+
+def checkFeed(api, dir):
+    """ Returns the number of failures. """
+    failed = 0
+
+    def expect(name, ok, output):
+        nonlocal failed
+        failed += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            print(output)
+
+    releases = len(api.releases)
+    betas = sum(r["prerelease"] for r in api.releases)
+
+    out = runFeed(api, dir)
+    feed = readFeed(dir)
+    expect("first run", statuses(api) == [200, 200, 200]
+           and f"feed.xml: {releases - betas} items" in out and f"feed-beta.xml: {releases} items" in out
+           and 'length="2000100"' in feed and 'length="1000101"' in feed, out)
+
+    out = runFeed(api, dir)
+    expect("no changes", statuses(api) == [304, 304, 304] and "up to date" in out, out)
+
+    with api.lock:
+        api.releases[-10]["body"] = "* An edited old release"
+    out = runFeed(api, dir)
+    expect("edited release on the last page", statuses(api) == [200, 304, 304]
+           and "1 descriptions rendered" in out and "An edited old release" in readFeed(dir), out)
+
+    with api.lock:
+        api.releases.insert(0, makeRelease(releases + 1, api.url))
+    out = runFeed(api, dir)
+    expect("new release", "1 descriptions rendered" in out and f"feed-beta.xml: {releases + 1} items" in out, out)
+
+    out = runFeed(api, dir, "--full")
+    expect("--full", statuses(api) == [304, 304, 304] and f"{releases + 1} descriptions rendered" in out, out)
+
+    with api.lock:
+        api.releases[0]["assets"].append({
+            "browser_download_url": f"{api.url}/dl/delta/Radiola3.2.51-3.2.50.delta", "size": 1234})
+    runFeed(api, dir)
+    out = runFeed(api, dir, "--deltas", "2")
+    expect("--deltas changed", "up to date" not in out and 'sparkle:deltaFrom="3.2.50"' in readFeed(dir), out)
+
+    out = runFeed(api, dir, "--deltas", "2", "--channels", "tag")
+    expect("--channels changed", "up to date" not in out
+           and "<sparkle:channel>beta</sparkle:channel>" in readFeed(dir, "feed.xml"), out)
+
+    out = runFeed(api, dir, "--deltas", "2", "--channels", "tag")
+    expect("the same options", "up to date" in out, out)
+
+    # Sparkle orders the items by sparkle:version, the bundle of a beta is built with the tag
+    with api.lock:
+        beta2 = makeRelease(releases + 2, api.url, beta=2)
+        beta2["assets"].append({
+            "browser_download_url": f"{api.url}/dl/delta/Radiola3.2.52-beta2-3.2.52-beta1.delta", "size": 1234})
+        api.releases[:0] = [beta2, makeRelease(releases + 2, api.url, beta=1)]
+    out = runFeed(api, dir, "--deltas", "2", "--channels", "tag")
+    feed = readFeed(dir, "feed.xml")
+    expect("two betas of one version", 'sparkle:version="3.2.52-beta1"' in feed
+           and 'sparkle:version="3.2.52-beta2"' in feed and 'sparkle:deltaFrom="3.2.52-beta1"' in feed
+           and 'sparkle:version="3.2.51"' in feed, out)
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="A local stand-in for the GitHub releases API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--releases", type=int, default=RELEASES, help=f"number of releases (default: {RELEASES})")
+    parser.add_argument("--check", action="store_true", help="run update-feed.py against the stand-in")
+    args = parser.parse_args()
+
+    if args.check:
+        api = Api("127.0.0.1", 0).start()
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                # update-feed.py writes the commit message to ../.git
+                os.mkdir(os.path.join(tmp, ".git"))
+                dir = os.path.join(tmp, "docs")
+                os.mkdir(dir)
+                sys.exit(1 if checkFeed(api, dir) else 0)
+        finally:
+            api.stop()
+
+    api = Api(args.host, args.port, args.releases)
+    print(f"Serving {args.releases} releases on {api.url}")
+    try:
+        api.serve_forever()
+    except KeyboardInterrupt:
+        pass
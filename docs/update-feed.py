@@ -6,19 +6,39 @@ GITHUB_REPO = "radiola"
 PROGRAM_NAME = "Radiola"
 
 FEED_FILE = "feed.xml"
+BETA_FEED_FILE = "feed-beta.xml"
 FEED_DESCRIPTION = "Most recent updates to "
 FEED_LANGUAGE    = "en"
 MIN_VERSION = "3.0"
 
-#######################################
-URL_TEMPLATE = "https://api.github.com/repos/%s/%s/releases?per_page=300"
+CACHE_DIR = "update-feed.cache"
+DOWNLOAD_THREADS = 8
+DELTA_VERSIONS = 0  # list sparkle:deltas from this many previous versions, 0 - no deltas
+
+# Where the prereleases go:
+#   files - FEED_FILE has stable releases only, BETA_FEED_FILE has all of them
+#   tag   - FEED_FILE has all releases, prereleases are in <sparkle:channel>beta</sparkle:channel>
+#   none  - no prereleases
+CHANNELS = "files"
+BETA_CHANNEL = "beta"
 
+#######################################
+API_URL = "https://api.github.com"
+URL_TEMPLATE = "%s/repos/%s/%s/releases?per_page=%d"
+PER_PAGE = 100   # GitHub cuts a bigger per_page to 100
+SPARKLE_NS = "http://www.andymatuschak.org/xml-namespaces/sparkle"
+
+import argparse
+import concurrent.futures
+import hashlib
 import sys
 import os
+import urllib.parse
 import urllib.request
 import json
 import re
-from xml.dom import minidom
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import unescape
 import datetime
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)) + '/libs/')
 import markdown
@@ -36,15 +56,46 @@ class Version(tuple):
 def versiontuple(str):
     return tuple(map(int, (str.split("."))))
 
+class Asset:
+    def __init__(self, url, size):
+        self.url = url
+        self.size = size or None    # None when the API has no size, see resolveSizes()
+
+
 class Release:
     def __init__(self, data):
         self.tag = data["tag_name"]
         self.version = self.extractVersion(self.tag)
+        # the version the bundle is built with (.github/workflows/bumpversion.sh
+        # takes the tag without "v"), so every beta has its own sparkle:version
+        suffix = re.search(r"-beta\d+", self.tag)
+        self.bundleVersion = self.version + (suffix.group(0) if suffix else "")
         self.prerelease = data["prerelease"]
         self.name = PROGRAM_NAME
-        self.url = self.getUrl(data)
+        self.asset = self.getAsset(data)
+        self.url = self.asset.url if self.asset else None
+        self.deltas = self.getDeltas(data)
         self.changeLog = data["body"]
+        self.published = data["published_at"]
         self.date = datetime.datetime.strptime(data["published_at"], '%Y-%m-%dT%H:%M:%SZ')
+        self.hash = hashlib.sha1(f"{self.tag}\0{self.changeLog}".encode()).hexdigest()
+
+        beta = re.search(r"-beta(\d+)", self.tag)
+        self.beta = int(beta.group(1)) if beta else 0
+        self.title = f"{PROGRAM_NAME} {self.version}"
+        if self.prerelease:
+            self.title += f" beta {self.beta}" if self.beta else " beta"
+
+        # newest first: the higher version, then the release before its betas, then the higher beta;
+        # for sorting only, Sparkle gets bundleVersion
+        self.key = (Version(self.version), not self.prerelease, self.beta)
+
+    def itemHash(self, deltas, channel):
+        """ Everything the item is made of, deltas is a list of (version, Asset). """
+        parts = [self.hash, self.bundleVersion, self.url, self.published, str(self.asset.size), channel or ""]
+        for version, asset in deltas:
+            parts += [version, asset.url, str(asset.size)]
+        return hashlib.sha1("\0".join(parts).encode()).hexdigest()
 
 
     def extractVersion(self, tag):
@@ -70,90 +121,450 @@ class Release:
 
         raise Error(f"Can't extract version from '{tag}' tag")
 
-    def getUrl(self, data):
+    def getAsset(self, data):
         for asset in data["assets"]:
             if asset["browser_download_url"].endswith(".dmg"):
-                return asset["browser_download_url"]
+                return Asset(asset["browser_download_url"], asset.get("size"))
 
         return None
 
+    def getDeltas(self, data):
+        """ {from bundle version: Asset} of the delta files made by Sparkle's
+            BinaryDelta, named as generate_appcast does: Radiola13.1.1-13.0.1.delta,
+            Radiola13.1.1-beta2-13.1.1-beta1.delta """
+        res = {}
+        for asset in data["assets"]:
+            url = asset["browser_download_url"]
+            m = re.search(r"(\d[\d.]*\d(?:-beta\d+)?)-(\d[\d.]*\d(?:-beta\d+)?)\.delta$", url)
+            if m and m.group(1) == self.bundleVersion:
+                res[m.group(2)] = Asset(url, asset.get("size"))
+
+        return res
+
+
+class Page:
+    def __init__(self, data, link, changed):
+        self.data = data
+        self.link = link
+        self.changed = changed
+
+
+class Cache:
+    """ Responses of the API on disk, keyed by URL, with their ETags. """
+    def __init__(self, dir):
+        self.dir = dir
+
+    def path(self, url):
+        return os.path.join(self.dir, hashlib.sha1(url.encode()).hexdigest() + ".json")
+
+    def load(self, url):
+        try:
+            with open(self.path(url), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            return entry if entry.get("url") == url else None
+        except (OSError, ValueError):
+            return None
+
+    def save(self, url, etag, link, data):
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = self.path(url) + ".part"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"url": url, "etag": etag, "link": link, "data": data}, f)
+        os.replace(tmp, self.path(url))
+
+
+def fetch(url, cache):
+    """ Downloads one page. A cached page is revalidated with If-None-Match,
+        a 304 answer costs nothing from the rate limit. """
+    entry = cache.load(url) if cache else None
+
+    request = urllib.request.Request(url, headers={"Accept": "application/vnd.github+json"})
+    if entry and entry.get("etag"):
+        request.add_header("If-None-Match", entry["etag"])
 
-def download(url):
     try:
-        response = urllib.request.urlopen(url)
-        res = response.read().decode('utf-8')
-        return json.loads(res)
+        response = urllib.request.urlopen(request)
+        data = json.loads(response.read().decode('utf-8'))
+        link = response.headers.get("Link")
+        if cache and response.headers.get("ETag"):
+            cache.save(url, response.headers["ETag"], link, data)
+        return Page(data, link, True)
 
     except urllib.error.HTTPError as err:
+        if err.code == 304 and entry:
+            return Page(entry["data"], entry["link"], False)
         raise Error("Can't download from %s: %s" % (url, err))
 
+    except urllib.error.URLError as err:
+        raise Error("Can't download from %s: %s" % (url, err.reason))
 
-def parse(data):
-    releases = []
-    for d in data:
-        release = Release(d)
-        releases.append(release)
 
+def parseLinks(header):
+    """ {rel: url} from the Link header. """
+    links = {}
+    for part in (header or "").split(","):
+        m = re.match(r'\s*<([^>]*)>\s*;\s*rel="([^"]*)"', part)
+        if m:
+            links[m.group(2)] = m.group(1)
+    return links
 
-    return releases
 
-def write(releases):
-    doc = minidom.Document()
+def pageUrls(link):
+    """ URLs of the pages 2..last, when the Link header has the last page. """
+    last = parseLinks(link).get("last")
+    if not last:
+        return None
+
+    parts = urllib.parse.urlsplit(last)
+    query = urllib.parse.parse_qs(parts.query)
+    count = int(query["page"][0])
 
-    def add(parent, tag):
-        node = doc.createElement(tag)
-        parent.appendChild(node)
-        return node
+    res = []
+    for n in range(2, count + 1):
+        query["page"] = [str(n)]
+        res.append(urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query, doseq=True))))
+    return res
 
 
-    def addText(parent, tag, text):
-        node = add(parent, tag)
-        node.appendChild(doc.createTextNode(text))
-        return node
+def download(url, cache=None):
+    """ Returns the data of all pages and whether any page has changed.
 
+        Every page is revalidated with its ETag: a new release changes the
+        first page, but an edited old release changes only its own page.
+        The 304 answers cost nothing from the rate limit. """
+    first = fetch(url, cache)
+    data = list(first.data)
+    changed = first.changed
 
-    rss = add(doc, "rss")
-    rss.setAttribute("version", "2.0")
-    rss.setAttribute('xmlns:sparkle', "http://www.andymatuschak.org/xml-namespaces/sparkle")
+    urls = pageUrls(first.link)
+    if urls is None:
+        # no "last" link, walk the "next" links one by one
+        page = first
+        while parseLinks(page.link).get("next"):
+            page = fetch(parseLinks(page.link)["next"], cache)
+            data += page.data
+            changed = changed or page.changed
+        return data, changed
 
-    channel = add(rss, "channel")
+    with concurrent.futures.ThreadPoolExecutor(DOWNLOAD_THREADS) as pool:
+        for page in pool.map(lambda u: fetch(u, cache), urls):
+            data += page.data
+            changed = changed or page.changed
 
-    add(channel, "title")
-    addText(channel, "description", FEED_DESCRIPTION)
-    addText(channel, "language", FEED_LANGUAGE)
+    return data, changed
 
-    min_version = Version(MIN_VERSION)
-    for r in releases:
 
-        if  Version(r.version) < min_version:
-            continue
+class HeadRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """ The release assets redirect to a CDN, the redirect keeps the HEAD method. """
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        new = super().redirect_request(req, fp, code, msg, headers, newurl)
+        if new is not None:
+            new.method = req.get_method()
+        return new
 
-        if r.prerelease:
-            continue
 
-        if not r.url:
-            continue
+def headSize(url):
+    opener = urllib.request.build_opener(HeadRedirectHandler)
+    try:
+        with opener.open(urllib.request.Request(url, method="HEAD"), timeout=30) as response:
+            size = response.headers.get("Content-Length", "")
+            return int(size) if size.isdigit() else None
+    except (urllib.error.URLError, OSError) as err:
+        print("Warning: can't get the size of %s: %s" % (url, err), file=sys.stderr)
+        return None
 
-        description = markdown.markdown(r.changeLog, tab_length=2)
 
-        item = add(channel, "item")
-        addText(item, "title", f"{PROGRAM_NAME} {r.version}")
-        addText(item, "description", description)
-        addText(item, "pubDate", r.date.strftime("%a, %d %b %Y %H:%M:%S +0000"))
+def resolveSizes(assets, file=None):
+    """ Sets the size of the assets the API doesn't know the size of, with
+        concurrent HEAD requests. The sizes are cached in the file by URL. """
+    sizes = {}
+    if file:
+        try:
+            with open(file, "r", encoding="utf-8") as f:
+                sizes = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    missing = [a for a in assets if not a.size and not sizes.get(a.url)]
+    urls = list(dict.fromkeys(a.url for a in missing))
+    if urls:
+        with concurrent.futures.ThreadPoolExecutor(DOWNLOAD_THREADS) as pool:
+            for url, size in zip(urls, pool.map(headSize, urls)):
+                if size:
+                    sizes[url] = size
+
+    for a in assets:
+        if not a.size:
+            a.size = sizes.get(a.url)
+
+    if file and urls:
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        with open(file + ".part", "w", encoding="utf-8") as f:
+            json.dump(sizes, f)
+        os.replace(file + ".part", file)
 
-        enclosure = add(item, "enclosure")
-        enclosure.setAttribute("url", r.url)
-        enclosure.setAttribute("sparkle:version", r.version)
-        enclosure.setAttribute("length", "0")
-        enclosure.setAttribute("type", "application/octet-stream")
+
+def parse(data):
+    releases = []
+    for d in data:
+        release = Release(d)
+        releases.append(release)
+
+
+    return releases
+
+def feedOptions(deltaVersions, channels):
+    """ The options the feeds were written with, other options need a new
+        feed even when the releases are the same. """
+    return {"deltas": deltaVersions, "channels": channels}
+
+
+class FeedCache:
+    """ The rendered descriptions by the hash of tag_name + body, and the hash
+        of every item in the feed, so unchanged items are copied from the old
+        feed without rendering. """
+    def __init__(self, file, load=True):
+        self.file = file
+        self.descriptions = {}
+        self.items = {}
+        self.options = {}
+
+        if not load:
+            return
+
+        try:
+            with open(file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.descriptions = data["descriptions"]
+            self.items = data["items"]
+            self.options = data.get("options", {})
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def save(self, descriptions, items, options):
+        self.descriptions = descriptions
+        self.items = items
+        self.options = options
+
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        tmp = self.file + ".part"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"descriptions": descriptions, "items": items, "options": options}, f)
+        os.replace(tmp, self.file)
+
+
+def escape(text):
+    """ Escapes text as minidom of Python 3.13 does, feed.xml was written by
+        it: quotes are left as is in text and escaped only in attributes. """
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def escapeAttr(text):
+    return escape(text).replace('"', "&quot;").replace("\r", "&#13;").replace("\n", "&#10;").replace("\t", "&#9;")
+
+
+def itemXml(title, description, pubDate, enclosure, deltas=(), channel=None):
+    """ The <item> block, indented as in feed.xml. enclosure and every delta
+        are lists of (name, value) attributes. """
+    def attrs(values):
+        return "".join(f' {name}="{escapeAttr(value)}"' for name, value in values)
+
+    res = (
+        "    <item>\n"
+        f"      <title>{escape(title)}</title>\n"
+        f"      <description>{escape(description)}</description>\n"
+        f"      <pubDate>{escape(pubDate)}</pubDate>\n"
+    )
+    if channel:
+        res += f"      <sparkle:channel>{escape(channel)}</sparkle:channel>\n"
+    res += f"      <enclosure{attrs(enclosure)}/>\n"
+    if deltas:
+        res += "      <sparkle:deltas>\n"
+        for delta in deltas:
+            res += f"        <enclosure{attrs(delta)}/>\n"
+        res += "      </sparkle:deltas>\n"
+    return res + "    </item>\n"
+
+
+def renderItem(r, description, deltas=(), channel=None):
+    return itemXml(
+        r.title,
+        description,
+        r.date.strftime("%a, %d %b %Y %H:%M:%S +0000"),
+        [
+            ("url", r.url),
+            ("sparkle:version", r.bundleVersion),
+            ("length", str(r.asset.size or 0)),
+            ("type", "application/octet-stream"),
+        ],
+        [
+            [
+                ("url", asset.url),
+                ("sparkle:version", r.bundleVersion),
+                ("sparkle:deltaFrom", version),
+                ("length", str(asset.size or 0)),
+                ("type", "application/octet-stream"),
+            ]
+            for version, asset in deltas
+        ],
+        channel)
+
+
+class FeedWriter:
+    """ Writes the RSS document item by item, the items go straight to the file. """
+    def __init__(self, f):
+        self.f = f
+        self.f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<rss version="2.0" xmlns:sparkle="{SPARKLE_NS}">\n'
+            "  <channel>\n"
+            "    <title/>\n"
+            f"    <description>{escape(FEED_DESCRIPTION)}</description>\n"
+            f"    <language>{escape(FEED_LANGUAGE)}</language>\n".encode("utf-8"))
+
+    def write(self, item):
+        self.f.write(item.encode("utf-8"))
+
+    def close(self):
+        self.f.write(b"  </channel>\n</rss>\n")
+
+
+def readItems(file):
+    """ {title: <item> block} of the existing feed. """
+    try:
+        with open(file, "r", encoding="utf-8") as f:
+            text = f.read()
+    except OSError:
+        return {}
+
+    items = {}
+    for m in re.finditer(r"^    <item>\n.*?^    </item>\n", text, re.S | re.M):
+        title = re.search(r"<title>(.*?)</title>", m.group(0))
+        if title:
+            items[unescape(title.group(1))] = m.group(0)
+    return items
+
+
+def feedFiles(channels):
+    """ {file: whether it has prereleases} """
+    if channels == "files":
+        return {FEED_FILE: False, BETA_FEED_FILE: True}
+    if channels == "tag":
+        return {FEED_FILE: True}
+    return {FEED_FILE: False}
+
+
+def write(releases, cache=None, deltaVersions=DELTA_VERSIONS, channels=CHANNELS):
+    """ Writes the feeds of the channels in one pass, every description is
+        rendered once. With the cache only new and changed items are
+        rendered, the others are spliced from the existing feeds. Every item
+        lists the deltas from up to deltaVersions previous versions of its
+        channel. """
+    files = feedFiles(channels)
+
+    min_version = Version(MIN_VERSION)
+    index = sorted((r for r in releases if r.key[0] >= min_version and r.url), key=lambda r: r.key, reverse=True)
+    stable = [r for r in index if not r.prerelease]
+    if not any(files.values()):
+        index = stable
+
+    deltas = {}
+    for channel in (stable, index):
+        for n, r in enumerate(channel):
+            older = [o.bundleVersion for o in channel[n + 1:n + 1 + deltaVersions]]
+            deltas.setdefault(r, [(v, r.deltas[v]) for v in older if v in r.deltas])
+
+    resolveSizes([r.asset for r in index] + [a for d in deltas.values() for _, a in d],
+                 os.path.join(CACHE_DIR, "sizes.json") if cache else None)
+
+    oldItems = {}
+    if cache:
+        for file in files:
+            oldItems.update(readItems(file))
+
+    descriptions = {}
+    items = {}
+    rendered = 0
+
+    feeds = []
+    for file, betas in files.items():
+        f = open(file + ".part", "wb")
+        feeds.append((file, f, FeedWriter(f), betas, []))
+
+    for r in index:
+        channel = BETA_CHANNEL if r.prerelease and channels == "tag" else None
+        itemHash = r.itemHash(deltas[r], channel)
+
+        description = cache.descriptions.get(r.hash) if cache else None
+        if description is None:
+            description = markdown.markdown(r.changeLog, tab_length=2)
+            rendered += 1
+        descriptions[r.hash] = description
+
+        block = oldItems.get(r.title)
+        if block is None or cache.items.get(r.title) != itemHash:
+            block = renderItem(r, description, deltas[r], channel)
+        items[r.title] = itemHash
+
+        for file, f, feed, betas, written in feeds:
+            if betas or not r.prerelease:
+                feed.write(block)
+                written.append(r)
 
         # print(f"<h2>{PROGRAM_NAME} {r.version}</h2")
         # print(description)
         # print("<hr>")
 
-    f =  open(FEED_FILE, "wb")
-    f.write(doc.toprettyxml(indent ="  ", encoding="UTF-8"))
-    f.close()
+    for file, f, feed, betas, written in feeds:
+        feed.close()
+        f.close()
+        os.replace(file + ".part", file)
+
+    if cache:
+        cache.save(descriptions, items, feedOptions(deltaVersions, channels))
+
+    for file, f, feed, betas, written in feeds:
+        print(f"{file}: {len(written)} items")
+    print(f"{rendered} descriptions rendered")
+
+def check(file):
+    """ Golden test of the writer: reads the items of the feed and writes
+        them again, the result must be the same bytes. """
+    with open(file, "rb") as f:
+        golden = f.read()
+
+    sparkle = "{%s}" % SPARKLE_NS
+
+    def attrs(node):
+        return [(name.replace(sparkle, "sparkle:"), value) for name, value in node.attrib.items()]
+
+    out = []
+    for item in ET.fromstring(golden).iter("item"):
+        out.append(itemXml(
+            item.findtext("title"),
+            item.findtext("description"),
+            item.findtext("pubDate"),
+            attrs(item.find("enclosure")),
+            [attrs(e) for e in item.findall(f"{sparkle}deltas/enclosure")],
+            item.findtext(f"{sparkle}channel")))
+
+    class Buffer(list):
+        def write(self, data):
+            self.append(data)
+
+    buf = Buffer()
+    feed = FeedWriter(buf)
+    for item in out:
+        feed.write(item)
+    feed.close()
+    res = b"".join(buf)
+
+    if res != golden:
+        n = next((i for i in range(min(len(res), len(golden))) if res[i] != golden[i]), min(len(res), len(golden)))
+        line = golden[:n].count(b"\n") + 1
+        raise Error(f"{file}: the writer output differs at line {line}")
+    print(f"{file}: {len(out)} items, the same bytes")
+
 
 def writeCommitMessage(release):
     f =  open("../.git/GITGUI_MSG", "w")
@@ -161,14 +572,41 @@ def writeCommitMessage(release):
     f.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"Update the {PROGRAM_NAME} Sparkle feed from the GitHub releases.")
+    parser.add_argument("--api", default=API_URL, help=f"GitHub API URL (default: {API_URL})")
+    parser.add_argument("--no-cache", action="store_true", help=f"download everything, don't use {CACHE_DIR}")
+    parser.add_argument("--full", action="store_true", help="render all items, not only new and changed ones")
+    parser.add_argument("--deltas", type=int, default=DELTA_VERSIONS, metavar="N",
+                        help="list sparkle:deltas from the N previous versions (default: %d)" % DELTA_VERSIONS)
+    parser.add_argument("--channels", choices=["files", "tag", "none"], default=CHANNELS,
+                        help=f"prereleases in {BETA_FEED_FILE}, in {FEED_FILE} with sparkle:channel, or nowhere (default: {CHANNELS})")
+    parser.add_argument("--check", action="store_true", help=f"check that the writer reproduces {FEED_FILE} byte for byte")
+    args = parser.parse_args()
 
     try:
-        data = download(URL_TEMPLATE % (GITHUB_USER, GITHUB_REPO))
+        if args.check:
+            for file in [FEED_FILE, BETA_FEED_FILE]:
+                if file == FEED_FILE or os.path.exists(file):
+                    check(file)
+            sys.exit(0)
+
+        cache = None if args.no_cache else Cache(CACHE_DIR)
+        data, changed = download(URL_TEMPLATE % (args.api.rstrip("/"), GITHUB_USER, GITHUB_REPO, PER_PAGE), cache)
+
+        files = feedFiles(args.channels)
+        feedCache = None if args.no_cache else FeedCache(os.path.join(CACHE_DIR, "feed.json"), load=not args.full)
+        # --full loads no options, so it never stops here
+        if (feedCache and not changed and feedCache.options == feedOptions(args.deltas, args.channels)
+                and all(os.path.exists(f) for f in files)):
+            print("No new releases, %s is up to date" % ", ".join(files))
+            sys.exit(0)
+
         releases = parse(data)
-        write(releases)
+        write(releases, feedCache, args.deltas, args.channels)
 
         writeCommitMessage(releases[0])
 
 
     except Error as err:
         print("Error: %s" % err, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+
+# Benchmarks for icy-meta.py
+
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import os
+import re
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+
+def load_script(name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_").removesuffix(".py"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+icy = load_script("icy-meta.py")
+
+
+#######################################
+# Allocations: skipping the audio payload
+
+class SyntheticStream(io.RawIOBase):
+    """ An ICY stream of the given duration that is generated on the fly. """
+
+    def __init__(self, seconds, bitrate, meta_interval):
+        self.left = seconds * bitrate * 1000 // 8
+        self.meta_interval = meta_interval
+        self.pos = 0
+        self.frame = b"\x55" * meta_interval + b"\x02" + b"StreamTitle='Artist - Title';".ljust(32, b"\x00")
+        self.view = memoryview(self.frame)  # slices of the frame are not copied, the source allocates nothing
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self.left, len(self.frame) - self.pos)
+        buffer[:n] = self.view[self.pos:self.pos + n]
+        self.pos = (self.pos + n) % len(self.frame)
+        self.left -= n
+        return n
+
+
+class Churn:
+    """ Allocation churn measured by tracemalloc, tracing must be started.
+        The peak is reset before every frame, after the frame its rise over
+        the memory in use at the start is added. Objects that are created
+        and freed inside the frame are counted too, wherever they come from:
+        BufferedReader, StreamReader or the caller. It is a lower bound,
+        two objects that don't live at the same time count as the bigger one. """
+
+    def __init__(self):
+        self.total = 0
+        self.peak = 0       # the most memory in use at once
+        self.start = 0
+
+    def begin(self):
+        tracemalloc.reset_peak()
+        self.start = tracemalloc.get_traced_memory()[0]
+
+    def end(self):
+        peak = tracemalloc.get_traced_memory()[1]
+        self.total += peak - self.start
+        self.peak = max(self.peak, peak)
+
+
+def skip_read(response, length):
+    response.read(length)
+
+
+def skip_readinto(response, length, buffer = [None]):
+    if buffer[0] is None or len(buffer[0]) < length:
+        buffer[0] = memoryview(bytearray(length))
+    icy.skip(response, buffer[0], length)
+
+
+def run_sync(skip, seconds, bitrate, meta_interval):
+    response = io.BufferedReader(SyntheticStream(seconds, bitrate, meta_interval))
+    churn = Churn()
+    frames = 0
+    try:
+        while True:
+            churn.begin()
+            skip(response, meta_interval)
+            length = ord(response.read(1)) * 16
+            if length > 0:
+                response.read(length)
+            churn.end()
+            frames += 1
+    except (icy.Error, TypeError):
+        pass # end of the synthetic stream
+    return churn, frames
+
+
+class FakeTransport:
+    def pause_reading(self):
+        pass
+
+    def resume_reading(self):
+        pass
+
+
+async def run_async(seconds, bitrate, meta_interval, use_protocol):
+    """ Feeds the synthetic stream into asyncio.StreamReader (the old engine)
+        or into icy.IcyStream and reads all frames. """
+    source = SyntheticStream(seconds, bitrate, meta_interval)
+    chunk = bytearray(16 * 1024)
+    churn = Churn()
+    frames = 0
+
+    if use_protocol:
+        stream = icy.IcyStream()
+        stream.connection_made(FakeTransport())
+
+        def feed():
+            buf = stream.get_buffer(-1)
+            n = source.readinto(buf)
+            if n:
+                stream.buffer_updated(n)
+            else:
+                stream.eof_received()
+
+        async def frame():
+            await icy.read_metadata(stream, meta_interval)
+    else:
+        stream = asyncio.StreamReader(limit = 2 ** 20)
+
+        def feed():
+            n = source.readinto(chunk)
+            if n:
+                stream.feed_data(memoryview(chunk)[:n])
+            else:
+                stream.feed_eof()
+
+        async def frame():
+            await stream.readexactly(meta_interval)
+            length = (await stream.readexactly(1))[0] * 16
+            if length > 0:
+                await stream.readexactly(length)
+
+    async def producer():
+        while source.left:
+            feed()
+            await asyncio.sleep(0)
+        feed()
+
+    task = asyncio.create_task(producer())
+    try:
+        while True:
+            # the producer runs between the awaits, what it allocates is counted too
+            churn.begin()
+            await frame()
+            churn.end()
+            frames += 1
+    except asyncio.IncompleteReadError:
+        pass
+    await task
+    return churn, frames
+
+
+def bench_alloc(args):
+    seconds = 3600
+    print(f"One hour of stream: {args.bitrate} kbit/s, icy-metaint {args.meta_interval}")
+    print("churn - memory allocated and freed while reading the frames, see Churn")
+    print(f"{'path':<28} {'frames':>8} {'churn, MB':>14} {'peak, KB':>9} {'time, s':>8}")
+
+    cases = [
+        ("sync read()",           lambda: run_sync(skip_read, seconds, args.bitrate, args.meta_interval)),
+        ("sync readinto()",       lambda: run_sync(skip_readinto, seconds, args.bitrate, args.meta_interval)),
+        ("async StreamReader",    lambda: asyncio.run(run_async(seconds, args.bitrate, args.meta_interval, False))),
+        ("async IcyStream",       lambda: asyncio.run(run_async(seconds, args.bitrate, args.meta_interval, True))),
+    ]
+
+    for name, func in cases:
+        tracemalloc.start()
+        start = time.perf_counter()
+        churn, frames = func()
+        elapsed = time.perf_counter() - start
+        tracemalloc.stop()
+        print(f"{name:<28} {frames:>8} {churn.total / 1024 / 1024:>14.2f} {churn.peak // 1024:>9} {elapsed:>8.2f}")
+
+
+#######################################
+# Throughput: pollers against the local simulator (icy-server.py)
+
+def start_server(args):
+    cmd = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "icy-server.py"),
+        "--port", str(args.port),
+        "--meta-interval", str(args.meta_interval),
+        "--bitrate", str(args.bitrate),
+        "--title-interval", str(args.title_interval),
+        "--drop-after", str(args.drop_after),
+    ]
+    server = subprocess.Popen(cmd, stdout = subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", args.port), timeout = 1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+
+    server.kill()
+    raise SystemExit("Can't start icy-server.py")
+
+
+class Events:
+    """ Replaces icy.report and measures the time from a title change
+        on the server to the event in the poller. """
+
+    TIME_RE = re.compile(r"@(\d+\.\d+)$")
+
+    def __init__(self):
+        self.seen = set()
+        self.count = 0
+        self.latencies = []
+        self.lock = threading.Lock()
+
+    def __call__(self, url, fields):
+        now = time.time()
+        with self.lock:
+            self.count += 1
+            if url not in self.seen:
+                # the first title of a connection was changed before we connected
+                self.seen.add(url)
+                return
+
+            m = self.TIME_RE.search(fields.get("StreamTitle", ""))
+            if m:
+                self.latencies.append(now - float(m.group(1)))
+
+
+def run_pollers(args, urls):
+    if args.mode == "sync":
+        for url in urls:
+            threading.Thread(target = icy.watch_radio, args = (url,), daemon = True).start()
+        time.sleep(args.duration)
+        return
+
+    engine = icy.sample_radios if args.mode == "sample" else icy.poll_radios
+
+    async def run():
+        try:
+            await asyncio.wait_for(engine(urls, args.max_connections), args.duration)
+        except asyncio.TimeoutError:
+            pass
+
+    asyncio.run(run())
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def bench_throughput(args):
+    server = start_server(args)
+    try:
+        events = Events()
+        icy.report = events
+        icy.report_error = lambda *args: None
+
+        urls = [f"http://127.0.0.1:{args.port}/station-{i}" for i in range(args.streams)]
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.monotonic()
+        with contextlib.redirect_stdout(io.StringIO()): # poll_radio() prints the headers
+            run_pollers(args, urls)
+        elapsed = time.monotonic() - start
+        end_usage = resource.getrusage(resource.RUSAGE_SELF)
+    finally:
+        server.kill()
+
+    cpu = (end_usage.ru_utime - usage.ru_utime) + (end_usage.ru_stime - usage.ru_stime)
+    load = cpu / elapsed
+
+    print(f"Mode:               {args.mode}")
+    print(f"Streams:            {args.streams}")
+    print(f"Duration:           {elapsed:.1f} s")
+    print(f"Events:             {events.count}")
+    print(f"CPU:                {cpu:.2f} s ({load * 100:.1f}% of a core)")
+    print(f"CPU per stream:     {load * 100 / args.streams:.3f}% of a core")
+    print(f"Streams per core:   {args.streams / load:.0f}" if load else "Streams per core:   -")
+    print(f"Change to event:    p50 {percentile(events.latencies, 50) * 1000:.0f} ms, "
+          f"p99 {percentile(events.latencies, 99) * 1000:.0f} ms, "
+          f"max {max(events.latencies, default = float('nan')) * 1000:.0f} ms "
+          f"({len(events.latencies)} changes)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmarks for icy-meta.py")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+
+    alloc = subparsers.add_parser("alloc", help = "memory churn per hour of stream")
+    alloc.add_argument("--bitrate", type = int, default = 128, help = "stream bitrate, kbit/s (default: 128)")
+    alloc.add_argument("--meta-interval", type = int, default = 16000, help = "icy-metaint (default: 16000)")
+    alloc.set_defaults(func = bench_alloc)
+
+    throughput = subparsers.add_parser("throughput", help = "poll N simulated streams")
+    throughput.add_argument("--mode", choices = ["async", "sample", "sync"], default = "async",
+                            help = "async - poll_radios(), sample - sample_radios(), sync - watch_radio() per thread (default: async)")
+    throughput.add_argument("--streams", type = int, default = 100, help = "number of streams (default: 100)")
+    throughput.add_argument("--duration", type = float, default = 30, help = "seconds (default: 30)")
+    throughput.add_argument("--max-connections", type = int, default = 1000, help = "for the async modes (default: 1000)")
+    throughput.add_argument("--port", type = int, default = 8765, help = "simulator port (default: 8765)")
+    throughput.add_argument("--bitrate", type = int, default = 128, help = "kbit/s (default: 128)")
+    throughput.add_argument("--meta-interval", type = int, default = 8192, help = "icy-metaint (default: 8192)")
+    throughput.add_argument("--title-interval", type = float, default = 5, help = "seconds between title changes (default: 5)")
+    throughput.add_argument("--drop-after", type = float, default = 0, help = "mean seconds before the simulator drops a connection (default: 0)")
+    throughput.set_defaults(func = bench_throughput)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -1,34 +1,705 @@
 #!/usr/bin/env python3
 
 import urllib.request
+import urllib.parse
+import http.client
 import contextlib
 import argparse
 import datetime
+import asyncio
+import array
+import bisect
+import json
+import random
+import re
+import ssl
+import sys
+import time
+import xml.etree.ElementTree as ET
 
 
-def poll_radio(url):
+USER_AGENT = 'User-Agent: VLC/2.0.5 LibVLC/2.0.5'
+MAX_REDIRECTS = 5
+MAX_CONNECTIONS = 50
+BUFFER_SIZE = 64 * 1024
+
+# sampling mode
+SAMPLE_BLOCKS = 2           # metadata blocks to read before giving up on a connection
+MIN_SAMPLE_DELAY = 15       # seconds
+MAX_SAMPLE_DELAY = 600
+INITIAL_TITLE_DURATION = 180
+
+# reconnects
+RECONNECT_MIN_DELAY = 1     # seconds, doubles with every failure
+RECONNECT_MAX_DELAY = 120
+MAX_RECONNECTS = 10         # simultaneous connection attempts
+CONNECT_TIMEOUT = 15        # seconds to connect and read the response headers
+STALL_TIMEOUT = 60          # seconds without a complete metadata frame before the stream is dropped
+BREAKER_FAILURES = 6        # after that many failures in a row the station is checked rarely
+BREAKER_DELAY = 900
+
+# metrics, upper bounds of the read latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# output format, "text" or "json" (JSON Lines)
+OUTPUT_FORMAT = "text"
+
+# tried in order, latin-1 always succeeds
+ENCODINGS = ("utf-8", "cp1252", "latin-1")
+
+# StreamTitle='It's a title';StreamUrl='';
+# the value ends with '; followed by the next key or the end of the block
+METADATA_RE = re.compile(rb"(\w+)='(.*?)';(?=\s*\w+='|\s*$)", re.DOTALL)
+
+
+class Error(Exception):
+    pass
+
+
+class Histogram:
+    """ Counts observations in fixed buckets, the last one is +Inf. """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = array.array("Q", [0] * (len(buckets) + 1))
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Station:
+    """ The state of a polled station that outlives its connections:
+        the last reported metadata, the reconnect backoff and the metrics. """
+
+    def __init__(self, url):
+        self.url = url
+        self.fields = None
+        self.failures = 0
+
+        self.bytes_read = 0
+        self.frames = 0
+        self.changes = 0
+        self.reconnects = 0
+        self.first_metadata = None  # seconds from connecting to the first metadata, last connection
+        self.read_latency = Histogram(LATENCY_BUCKETS)
+
+    def update(self, fields):
+        """ Returns True if the metadata has changed. """
+        if not fields or fields == self.fields:
+            return False
+        self.fields = fields
+        self.changes += 1
+        return True
+
+    def connected(self):
+        self.failures = 0
+
+    def reconnect_delay(self):
+        """ Exponential backoff with jitter, so stations dropped by the same
+            network blip don't come back all at once. After BREAKER_FAILURES
+            failures in a row the circuit breaker opens and the station is
+            only retried every BREAKER_DELAY seconds. """
+        self.failures += 1
+        self.reconnects += 1
+        if self.failures >= BREAKER_FAILURES:
+            delay = BREAKER_DELAY
+        else:
+            delay = min(RECONNECT_MAX_DELAY, RECONNECT_MIN_DELAY * 2 ** self.failures)
+        return random.uniform(delay / 2, delay)
+
+
+def decode(data):
+    for encoding in ENCODINGS:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+
+
+def parse_metadata(raw):
+    """ Decodes an ICY metadata block into a dict like {"StreamTitle": "...", "StreamUrl": "..."}.
+        The NUL padding is stripped, every value is decoded on its own
+        because stations mix encodings. """
+    raw = raw.rstrip(b"\0").strip()
+    fields = {decode(k): decode(v).strip() for k, v in METADATA_RE.findall(raw)}
+
+    if not fields and raw:
+        # not in the key='value'; form, treat the whole block as a title
+        fields = {"StreamTitle": decode(raw)}
+
+    return fields
+
+
+def report(url, fields):
+    now = datetime.datetime.now()
+    if OUTPUT_FORMAT == "json":
+        event = {"time": now.astimezone().isoformat(), "url": url}
+        event.update(fields)
+        print(json.dumps(event, ensure_ascii = False), flush = True)
+    else:
+        print(now, url, ":", " ".join(f"{k}='{v}'" for k, v in fields.items()), flush = True)
+
+
+def get_meta_interval(url, value):
+    if not value or not value.strip().isdigit() or int(value) == 0:
+        raise Error(f"{url} doesn't send ICY metadata")
+    return int(value)
+
+
+def poll_radio(url, station = None):
+    station = station or Station(url)
     request = urllib.request.Request(url, headers = {
-        'User-Agent' : 'User-Agent: VLC/2.0.5 LibVLC/2.0.5',
+        'User-Agent' : USER_AGENT,
         'Icy-MetaData' : '1',
         'Range' : 'bytes=0-',
     })
     # the connection will be close on exit from with block
-    with contextlib.closing(urllib.request.urlopen(request)) as response:
+    # the socket timeout covers the connect and every read, a stalled stream raises TimeoutError
+    with contextlib.closing(urllib.request.urlopen(request, timeout = STALL_TIMEOUT)) as response:
 
-        meta_interval = int(response.getheader("icy-metaint"))
-        print(":::::::::::::::::::::::::::::::::::::::::::::")
-        for h in response.getheaders():
-            print(f"{h[0]}: {h[1]}")
-        print(".............................................")
+        meta_interval = get_meta_interval(url, response.getheader("icy-metaint"))
+        if OUTPUT_FORMAT == "text":
+            print(":::::::::::::::::::::::::::::::::::::::::::::")
+            for h in response.getheaders():
+                print(f"{h[0]}: {h[1]}")
+            print(".............................................")
 
 
+        buffer = memoryview(bytearray(meta_interval))
         while True:
-            response.read(meta_interval) # throw away the data until the meta interval
+            skip(response, buffer, meta_interval) # throw away the data until the meta interval
+
+            length = response.read(1)
+            if not length:
+                raise Error("Unexpected end of stream")
 
-            length = ord(response.read(1)) * 16 # length is encoded in the stream
+            length = ord(length) * 16 # length is encoded in the stream
+            station.connected()
             if length > 0:
-                metadata = response.read(length)
-                print(datetime.datetime.now(), ":", metadata)
+                fields = parse_metadata(response.read(length))
+                if station.update(fields):
+                    report(url, fields)
+
+
+def watch_radio(url):
+    """ Runs poll_radio() and reconnects when the stream fails. """
+    station = Station(url)
+    while True:
+        try:
+            poll_radio(url, station)
+        except STREAM_ERRORS as err:
+            delay = station.reconnect_delay()
+            report_error(url, err, delay)
+            time.sleep(delay)
+
+
+def skip(response, buffer, length):
+    """ Reads and drops length bytes, the data goes to the reusable buffer
+        so no bytes objects are created for the audio payload. """
+    while length > 0:
+        n = response.readinto(buffer[:min(length, len(buffer))])
+        if not n:
+            raise Error("Unexpected end of stream")
+        length -= n
+
+
+#######################################
+# asyncio engine: many stations in one event loop
+
+class IcyStream(asyncio.BufferedProtocol):
+    """ Receives the stream straight into one preallocated buffer.
+        Skipped audio is overwritten in place instead of being copied
+        into new bytes objects. """
+
+    def __init__(self, size = BUFFER_SIZE):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0          # unread data is buffer[start:end]
+        self.end = 0
+        self.skipping = 0       # bytes to drop as soon as they arrive
+        self.discard = False
+        self.received = 0
+        self.transport = None
+        self.waiter = None
+        self.eof = False
+        self.error = None
+        self.paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.error = exc
+        self.eof = True
+        self._wake()
+
+    def eof_received(self):
+        self.eof = True
+        self._wake()
+        return False
+
+    def get_buffer(self, sizehint):
+        self.discard = self.skipping > 0 and self.start == self.end
+        if self.discard:
+            self.start = self.end = 0
+            return self.view[:min(self.skipping, len(self.buffer))]
+
+        if self.end == len(self.buffer):
+            self._compact()
+        return self.view[self.end:]
+
+    def buffer_updated(self, nbytes):
+        self.received += nbytes
+        if self.discard:
+            self.skipping -= nbytes
+        else:
+            self.end += nbytes
+            if self.start == 0 and self.end == len(self.buffer):
+                self.transport.pause_reading()
+                self.paused = True
+        self._wake()
+
+    def _compact(self):
+        # rare: happens only when the unread tail reaches the end of the buffer
+        size = self.end - self.start
+        self.buffer[:size] = bytes(self.view[self.start:self.end])
+        self.start = 0
+        self.end = size
+
+    def _wake(self):
+        if self.waiter and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def _consume(self, size):
+        self.start += size
+        if self.start == self.end:
+            self.start = self.end = 0
+        if self.paused:
+            self.paused = False
+            self.transport.resume_reading()
+
+    async def _wait(self, expected):
+        if self.eof:
+            if self.error:
+                raise self.error
+            raise asyncio.IncompleteReadError(bytes(self.view[self.start:self.end]), expected)
+
+        self.waiter = asyncio.get_running_loop().create_future()
+        try:
+            await self.waiter
+        finally:
+            self.waiter = None
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+
+    async def readline(self):
+        while True:
+            pos = self.buffer.find(b"\n", self.start, self.end)
+            if pos >= 0:
+                line = bytes(self.view[self.start:pos + 1])
+                self._consume(pos + 1 - self.start)
+                return line
+            if self.end - self.start == len(self.buffer):
+                raise Error("Line is too long")
+            await self._wait(None)
+
+    async def read(self, size):
+        """ Reads exactly size bytes. """
+        if size > len(self.buffer):
+            raise Error(f"Can't read {size} bytes at once")
+        while self.end - self.start < size:
+            await self._wait(size)
+        data = bytes(self.view[self.start:self.start + size])
+        self._consume(size)
+        return data
+
+    async def read_byte(self):
+        while self.end == self.start:
+            await self._wait(1)
+        res = self.buffer[self.start]
+        self._consume(1)
+        return res
+
+    async def skip(self, size):
+        """ Drops exactly size bytes. """
+        n = min(size, self.end - self.start)
+        self._consume(n)
+        self.skipping = size - n
+        while self.skipping > 0:
+            await self._wait(size)
+
+
+async def open_stream(url, redirects = MAX_REDIRECTS):
+    """ Sends the ICY request and reads the response headers.
+        Returns (stream, headers), headers keys are lowercased. """
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        raise Error(f"Unsupported URL scheme '{parts.scheme}'")
+
+    tls = parts.scheme == "https"
+    host = parts.hostname
+    port = parts.port or (443 if tls else 80)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+
+    loop = asyncio.get_running_loop()
+    _, stream = await loop.create_connection(
+        IcyStream, host, port,
+        ssl = ssl.create_default_context() if tls else None,
+        server_hostname = host if tls else None)
+
+    try:
+        # HTTP/1.0 keeps servers from switching to the chunked transfer encoding
+        stream.write((
+            f"GET {path} HTTP/1.0\r\n"
+            f"Host: {parts.netloc}\r\n"
+            f"User-Agent: {USER_AGENT}\r\n"
+            f"Icy-MetaData: 1\r\n"
+            f"Range: bytes=0-\r\n"
+            f"Connection: close\r\n"
+            f"\r\n").encode("latin-1"))
+
+        status = (await stream.readline()).decode("latin-1").split(None, 2)
+        if len(status) < 2 or not status[1].isdigit():
+            raise Error(f"Invalid response from {url}")
+
+        headers = {}
+        while True:
+            line = await stream.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        code = int(status[1])
+        if code in (301, 302, 303, 307, 308) and "location" in headers:
+            if redirects == 0:
+                raise Error(f"Too many redirects for {url}")
+            stream.close()
+            return await open_stream(urllib.parse.urljoin(url, headers["location"]), redirects - 1)
+
+        if code not in (200, 206):
+            raise Error(f"Can't open {url}: {' '.join(status[1:]).strip()}")
+
+        return stream, headers
+
+    except BaseException:
+        stream.close()
+        raise
+
+
+STREAM_ERRORS = (Error, OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError, http.client.HTTPException)
+
+
+def report_error(url, err, delay = None):
+    msg = f"{err or type(err).__name__}"
+    if delay is not None:
+        msg += f", reconnect in {delay:.0f} s"
+    print(datetime.datetime.now(), url, ": Error:", msg, file = sys.stderr, flush = True)
+
+
+async def read_metadata(stream, meta_interval):
+    """ Returns the next metadata block or None if it is empty. """
+    await stream.skip(meta_interval) # throw away the data until the meta interval
+
+    length = await stream.read_byte() * 16 # length is encoded in the stream
+    if length > 0:
+        return await stream.read(length)
+    return None
+
+
+async def read_frame(station, stream, meta_interval):
+    """ read_metadata() that updates the station metrics. """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    received = stream.received
+
+    try:
+        metadata = await asyncio.wait_for(read_metadata(stream, meta_interval), STALL_TIMEOUT)
+    except asyncio.TimeoutError:
+        # a half-open connection never fails by itself
+        raise Error(f"No data for {STALL_TIMEOUT} s")
+
+    station.read_latency.observe(loop.time() - start)
+    station.frames += 1
+    station.bytes_read += stream.received - received
+    return metadata
+
+
+async def connect(url, connecting):
+    """ Opens the stream, connecting limits the number of simultaneous attempts.
+        A blackholed host gives up its slot after CONNECT_TIMEOUT. """
+    async with connecting:
+        try:
+            stream, headers = await asyncio.wait_for(open_stream(url), CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise Error(f"Connection timed out after {CONNECT_TIMEOUT} s")
+    try:
+        return stream, headers, get_meta_interval(url, headers.get("icy-metaint"))
+    except BaseException:
+        stream.close()
+        raise
+
+
+async def poll_radio_async(station, limit, connecting):
+    async with limit:
+        start = time.monotonic()
+        stream, headers, meta_interval = await connect(station.url, connecting)
+        try:
+            metadata = await read_frame(station, stream, meta_interval)
+            station.first_metadata = time.monotonic() - start
+            while True:
+                station.connected()
+                if metadata:
+                    fields = parse_metadata(metadata)
+                    if station.update(fields):
+                        report(station.url, fields)
+
+                metadata = await read_frame(station, stream, meta_interval)
+        finally:
+            stream.close()
+
+
+async def poll_radios(urls, max_connections = MAX_CONNECTIONS, metrics = None):
+    """ Polls all stations in one event loop, at most max_connections are open at the same time.
+        Failed streams are reopened, see Station.reconnect_delay(). """
+    limit = asyncio.Semaphore(max_connections)
+    connecting = asyncio.Semaphore(MAX_RECONNECTS)
+    stations = [Station(url) for url in urls]
+    if len(stations) > max_connections:
+        # a stream holds its slot until it fails, so the rest wait for a failure
+        print(f"Warning: {len(stations)} stations, but only {max_connections} streams are kept open, "
+              f"the other {len(stations) - max_connections} are polled only when an open stream fails. "
+              f"Use -c {len(stations)} or --sample to poll all of them.", file = sys.stderr, flush = True)
+    if metrics:
+        await serve_metrics(metrics, stations)
+
+    async def poll(station):
+        while True:
+            try:
+                await poll_radio_async(station, limit, connecting)
+            except STREAM_ERRORS as err:
+                delay = station.reconnect_delay()
+                report_error(station.url, err, delay)
+                await asyncio.sleep(delay)
+
+    await asyncio.gather(*(poll(station) for station in stations))
+
+
+#######################################
+# sampling mode: connect, read one metadata block, disconnect
+
+class Sampler(Station):
+    """ Schedules reconnects for one station from how often its title
+        changed before, and counts the traffic. """
+
+    def __init__(self, url):
+        super().__init__(url)
+        self.changed_at = None
+        self.title_duration = INITIAL_TITLE_DURATION
+        self.byte_rate = 0          # from icy-br, bytes per second
+        self.first_sample = None
+        self.last_sample = None
+
+    def sampled(self, fields, headers, now):
+        """ Returns True if the metadata has changed. """
+        if self.first_sample is None:
+            self.first_sample = now
+        self.last_sample = now
+
+        br = headers.get("icy-br", "").split(",")[0]
+        if br.isdigit():
+            self.byte_rate = int(br) * 1000 // 8
+
+        if not self.update(fields):
+            return False
+
+        if self.changed_at is not None:
+            # the change happened somewhere between two samples, so smooth it out
+            self.title_duration = 0.7 * self.title_duration + 0.3 * (now - self.changed_at)
+
+        self.changed_at = now
+        return True
+
+    def next_delay(self, now):
+        if self.changed_at is None:
+            return MIN_SAMPLE_DELAY
+
+        left = self.changed_at + self.title_duration - now
+        if left <= 0:
+            # the change is overdue, look more often
+            left = self.title_duration / 4
+
+        return min(max(left, MIN_SAMPLE_DELAY), MAX_SAMPLE_DELAY)
+
+    def continuous_bytes(self):
+        """ Estimated traffic of the continuous mode for the same period. """
+        if self.first_sample is None or not self.byte_rate:
+            return None
+        return int((self.last_sample - self.first_sample) * self.byte_rate) + self.bytes_read
+
+
+async def sample_radio(sampler, limit, connecting):
+    """ Returns (parsed metadata, headers) of the first non-empty metadata block. """
+    async with limit:
+        start = time.monotonic()
+        stream, headers, meta_interval = await connect(sampler.url, connecting)
+        try:
+            fields = None
+            for _ in range(SAMPLE_BLOCKS):
+                metadata = await read_frame(sampler, stream, meta_interval)
+                fields = parse_metadata(metadata) if metadata else None
+                if fields:
+                    break
+
+            sampler.first_metadata = time.monotonic() - start
+            return fields, headers
+        finally:
+            stream.close()
+
+
+def print_savings(samplers):
+    read = 0
+    continuous = 0
+    for url, sampler in samplers.items():
+        c = sampler.continuous_bytes()
+        if c is None:
+            continue
+        read += sampler.bytes_read
+        continuous += c
+
+    print("\n.............................................", file = sys.stderr)
+    print(f"Read:       {read // 1024} KB", file = sys.stderr)
+    print(f"Continuous: {continuous // 1024} KB (estimated from icy-br)", file = sys.stderr)
+    if continuous:
+        print(f"Saved:      {(continuous - read) // 1024} KB ({(continuous - read) * 100 // continuous}%)", file = sys.stderr)
+
+
+async def sample_radios(urls, max_connections = MAX_CONNECTIONS, metrics = None):
+    """ Checks every station on its own adaptive schedule instead of keeping the streams open. """
+    limit = asyncio.Semaphore(max_connections)
+    connecting = asyncio.Semaphore(MAX_RECONNECTS)
+    samplers = {url: Sampler(url) for url in urls}
+    if metrics:
+        await serve_metrics(metrics, samplers.values())
+
+    async def watch(sampler):
+        while True:
+            try:
+                fields, headers = await sample_radio(sampler, limit, connecting)
+                now = time.monotonic()
+                sampler.connected()
+                if sampler.sampled(fields, headers, now):
+                    report(sampler.url, fields)
+                delay = sampler.next_delay(now)
+            except STREAM_ERRORS as err:
+                delay = max(sampler.reconnect_delay(), MIN_SAMPLE_DELAY)
+                report_error(sampler.url, err, delay)
+
+            await asyncio.sleep(delay)
+
+    try:
+        await asyncio.gather(*(watch(sampler) for sampler in samplers.values()))
+    finally:
+        print_savings(samplers)
+
+
+#######################################
+# metrics in the Prometheus text format
+
+METRICS = (
+    # name, type, help, value
+    ("icy_bytes_read_total",    "counter", "Bytes received from the stream.",                   lambda s: s.bytes_read),
+    ("icy_frames_total",        "counter", "Metadata frames read, rate() gives frames per minute.", lambda s: s.frames),
+    ("icy_title_changes_total", "counter", "Metadata changes.",                                 lambda s: s.changes),
+    ("icy_reconnects_total",    "counter", "Failed connections and dropped streams.",           lambda s: s.reconnects),
+    ("icy_first_metadata_seconds", "gauge", "Time from connecting to the first metadata frame.", lambda s: s.first_metadata),
+)
+
+
+def label(url):
+    url = url.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'{{url="{url}"}}'
+
+
+def format_metrics(stations):
+    lines = []
+    for name, kind, help, value in METRICS:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for s in stations:
+            v = value(s)
+            if v is not None:
+                lines.append(f"{name}{label(s.url)} {v}")
+
+    name = "icy_read_latency_seconds"
+    lines.append(f"# HELP {name} Time to read one metadata frame.")
+    lines.append(f"# TYPE {name} histogram")
+    for s in stations:
+        url = label(s.url)[1:-1]
+        h = s.read_latency
+        total = 0
+        for bound, count in zip(h.buckets + ("+Inf",), h.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{url},le="{bound}"}} {total}')
+        lines.append(f"{name}_sum{{{url}}} {h.sum}")
+        lines.append(f"{name}_count{{{url}}} {total}")
+
+    return "\n".join(lines) + "\n"
+
+
+async def serve_metrics(address, stations):
+    """ Serves GET /metrics on [host:]port. """
+    host, _, port = address.rpartition(":")
+    stations = list(stations)
+
+    async def handle(reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            if request.split(None, 2)[1:2] == [b"/metrics"]:
+                body = format_metrics(stations).encode("utf-8")
+                writer.write(b"HTTP/1.0 200 OK\r\n"
+                             b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n" +
+                             f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+            else:
+                writer.write(b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+            await writer.drain()
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host or "127.0.0.1", int(port))
+
+
+def load_stations(path):
+    """ Reads stream URLs from an OPML bookmarks file, a RadioBrowser JSON dump
+        or a plain text file with one URL per line. """
+    with open(path, "r", encoding = "utf-8") as f:
+        text = f.read()
+
+    if path.endswith(".json"):
+        urls = []
+        for item in json.loads(text):
+            if isinstance(item, str):
+                urls.append(item)
+            else:
+                urls.append(item.get("url_resolved") or item.get("url"))
+        return [u for u in urls if u]
+
+    if text.lstrip().startswith("<"):
+        root = ET.fromstring(text)
+        return [o.get("url") for o in root.iter("outline") if o.get("url")]
+
+    return [line.strip() for line in text.splitlines() if line.strip() and not line.startswith("#")]
 
 
 if __name__ == "__main__":
@@ -38,12 +709,57 @@ if __name__ == "__main__":
         'url',
         metavar='URL',
         type=str,
-        nargs=1,
+        nargs='*',
         help='stream URL')
 
+    parser.add_argument(
+        '-s', '--stations',
+        metavar='FILE',
+        help='read stream URLs from OPML, JSON or text file')
+
+    parser.add_argument(
+        '-c', '--max-connections',
+        metavar='N',
+        type=int,
+        default=MAX_CONNECTIONS,
+        help=f'maximum number of simultaneously open streams (default: {MAX_CONNECTIONS}); '
+             'without --sample a stream stays open until it fails, so the stations over '
+             'the limit are polled only when another stream fails')
+
+    parser.add_argument(
+        '--sample',
+        action='store_true',
+        help='do not keep streams open, reconnect on a schedule learned from title changes')
+
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='print metadata changes as JSON Lines')
+
+    parser.add_argument(
+        '--metrics',
+        metavar='[HOST:]PORT',
+        help='serve per-station metrics for Prometheus on http://HOST:PORT/metrics')
+
     args = parser.parse_args()
 
+    urls = list(args.url)
+    if args.stations:
+        urls += load_stations(args.stations)
+    urls = list(dict.fromkeys(urls))
+
+    if not urls:
+        parser.error("no stream URL given")
+
+    if args.json:
+        OUTPUT_FORMAT = "json"
+
     try:
-        poll_radio(args.url[0])
+        if args.sample:
+            asyncio.run(sample_radios(urls, args.max_connections, args.metrics))
+        elif len(urls) == 1 and not args.stations and not args.metrics:
+            watch_radio(urls[0])
+        else:
+            asyncio.run(poll_radios(urls, args.max_connections, args.metrics))
     except KeyboardInterrupt:
         exit(0)
@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+
+# Resolves .m3u, .pls, .asx and .xspf playlists to stream URLs, the same way
+# Radiola's PlayList does. Playlists inside playlists are followed up to
+# MAX_DEPTH levels, a URL is never fetched twice in one chain, and every
+# result is cached by URL + ETag, so the next run costs a 304.
+#
+#   ./icy-playlist.py http://example.com/radio.pls
+#   ./icy-playlist.py --check ../RadiolaTests/data
+
+import argparse
+import asyncio
+import codecs
+import glob
+import json
+import os
+import re
+import ssl
+import sys
+import urllib.parse
+import xml.etree.ElementTree as ET
+
+
+USER_AGENT = "Mozilla/5.0"
+MAX_CONNECTIONS = 50
+MAX_DEPTH = 5
+MAX_REDIRECTS = 5
+MAX_SIZE = 256 * 1024       # a larger body is not a playlist
+TIMEOUT = 15                # seconds, as in PlayList.download
+CHUNK_SIZE = 16 * 1024
+
+FORMATS = {"m3u8": "hls", "m3u": "m3u", "pls": "pls", "asx": "asx", "xspf": "xspf"}
+CONTENT_TYPES = {
+    "audio/x-mpegurl": "m3u", "audio/mpegurl": "m3u", "application/vnd.apple.mpegurl": "hls",
+    "application/x-mpegurl": "hls", "audio/x-scpls": "pls", "video/x-ms-asf": "asx",
+    "video/x-ms-asx": "asx", "audio/x-ms-asx": "asx", "application/xspf+xml": "xspf",
+}
+
+
+class Error(Exception):
+    pass
+
+
+class Link:
+    def __init__(self, url, title = None):
+        self.url = url
+        self.title = title
+
+    def __repr__(self):
+        return f"Link({self.url!r}, {self.title!r})"
+
+
+def url_format(url):
+    path = urllib.parse.urlsplit(url).path
+    return FORMATS.get(os.path.splitext(path)[1].lstrip(".").lower())
+
+
+def content_format(text):
+    """ The same checks as PlayList.getFormat(). """
+    lowered = text.lower()
+    if "#ext-x-" in lowered:
+        return "hls"
+    if "#extm3u" in lowered:
+        return "m3u"
+    if "[playlist]" in lowered:
+        return "pls"
+    if "<asx" in lowered:
+        return "asx"
+    if "http://xspf.org/ns" in lowered:
+        return "xspf"
+    return None
+
+
+def join(base, href):
+    href = href.strip()
+    return urllib.parse.urljoin(base, href) if base else href
+
+
+#######################################
+# Parsers: feed() the text as it arrives, close() returns the links
+
+class LineParser:
+    def __init__(self, base):
+        self.base = base
+        self.rest = ""
+        self.links = []
+
+    def feed(self, text):
+        lines = (self.rest + text).split("\n")
+        self.rest = lines.pop()
+        for line in lines:
+            self.line(line.strip())
+
+    def close(self):
+        if self.rest:
+            self.line(self.rest.strip())
+            self.rest = ""
+        return self.links
+
+
+class M3uParser(LineParser):
+    def __init__(self, base):
+        super().__init__(base)
+        self.title = None
+
+    def line(self, line):
+        if not line:
+            return
+        if line.startswith("#"):
+            if line.startswith("#EXTINF:"):
+                self.title = extinf_title(line)
+            return
+        self.links.append(Link(join(self.base, line), self.title))
+
+
+def extinf_title(line):
+    """ The text after the first comma outside quotes. """
+    in_quotes = False
+    for i, c in enumerate(line):
+        if c == '"':
+            in_quotes = not in_quotes
+        elif c == "," and not in_quotes:
+            return line[i + 1:].strip()
+    return None
+
+
+class PlsParser(LineParser):
+    def __init__(self, base):
+        super().__init__(base)
+        self.urls = {}
+        self.titles = {}
+
+    def line(self, line):
+        key, sep, value = line.partition("=")
+        if not sep:
+            return
+        key, value = key.strip(), value.strip()
+        if key.startswith("File") and key[4:].isdigit():
+            self.urls[int(key[4:])] = join(self.base, value)
+        elif key.startswith("Title") and key[5:].isdigit():
+            self.titles[int(key[5:])] = value
+
+    def close(self):
+        super().close()
+        return [Link(self.urls[n], self.titles.get(n)) for n in sorted(self.urls)]
+
+
+class XmlParser:
+    """ Collects the text and parses it at the end: the ASX files in the wild
+        are often not well-formed, and the fallback needs the whole text. """
+
+    def __init__(self, base):
+        self.base = base
+        self.parts = []
+
+    def feed(self, text):
+        self.parts.append(text)
+
+    def close(self):
+        text = "".join(self.parts).lstrip()
+        try:
+            root = ET.fromstring(text)
+        except ET.ParseError:
+            return self.fallback(text)
+        return self.parse(root)
+
+    def fallback(self, text):
+        return []
+
+
+def local_name(element):
+    return element.tag.rsplit("}", 1)[-1].lower()
+
+
+def child(element, name):
+    for c in element:
+        if local_name(c) == name:
+            return c
+    return None
+
+
+def element_text(element):
+    return "".join(element.itertext()).strip() if element is not None else None
+
+
+class AsxParser(XmlParser):
+    ENTRY_RE = re.compile(r"<entry\b.*?</entry\s*>", re.IGNORECASE | re.DOTALL)
+    REF_RE = re.compile(r"<ref\b[^>]*?\bhref\s*=\s*(['\"])(.*?)\1", re.IGNORECASE | re.DOTALL)
+    TITLE_RE = re.compile(r"<title\b[^>]*>(.*?)</title\s*>", re.IGNORECASE | re.DOTALL)
+
+    def parse(self, root):
+        links = []
+        for entry in root.iter():
+            if local_name(entry) != "entry":
+                continue
+            ref = child(entry, "ref")
+            href = next((v for k, v in (ref.attrib.items() if ref is not None else ()) if k.lower() == "href"), None)
+            if href:
+                links.append(Link(join(self.base, href), element_text(child(entry, "title"))))
+        return links
+
+    def fallback(self, text):
+        links = []
+        for entry in self.ENTRY_RE.findall(text):
+            ref = self.REF_RE.search(entry)
+            if ref:
+                title = self.TITLE_RE.search(entry)
+                links.append(Link(join(self.base, ref.group(2)), title.group(1).strip() if title else None))
+        return links
+
+
+class XspfParser(XmlParser):
+    def parse(self, root):
+        links = []
+        for track in root.iter():
+            if local_name(track) != "track":
+                continue
+            location = element_text(child(track, "location"))
+            if location:
+                links.append(Link(join(self.base, location), element_text(child(track, "title"))))
+        return links
+
+
+PARSERS = {"m3u": M3uParser, "pls": PlsParser, "asx": AsxParser, "xspf": XspfParser}
+
+
+def parse(text, base = None, fmt = None):
+    """ Parses the whole playlist text. """
+    fmt = fmt or content_format(text)
+    parser = PARSERS.get(fmt)
+    if parser is None:
+        return []
+    p = parser(base)
+    p.feed(text)
+    return p.close()
+
+
+#######################################
+# Resolver
+
+async def http_get(url, etag = None, redirects = MAX_REDIRECTS):
+    """ Sends a GET and returns (url, status, headers, reader, writer) after
+        the headers. HTTP/1.0 keeps the body plain, without chunks. """
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        raise Error(f"Unsupported URL scheme '{parts.scheme}'")
+    tls = parts.scheme == "https"
+    path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+
+    reader, writer = await asyncio.open_connection(
+        parts.hostname, parts.port or (443 if tls else 80),
+        ssl = ssl.create_default_context() if tls else None)
+    try:
+        request = (f"GET {path} HTTP/1.0\r\n"
+                   f"Host: {parts.netloc}\r\n"
+                   f"User-Agent: {USER_AGENT}\r\n")
+        if etag:
+            request += f"If-None-Match: {etag}\r\n"
+        writer.write((request + "\r\n").encode("latin-1"))
+
+        status = (await reader.readline()).decode("latin-1").split(None, 2)
+        if len(status) < 2 or not status[1].isdigit():
+            raise Error(f"Invalid response from {url}")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        code = int(status[1])
+        if code in (301, 302, 303, 307, 308) and "location" in headers:
+            writer.close()
+            if redirects == 0:
+                raise Error(f"Too many redirects for {url}")
+            return await http_get(urllib.parse.urljoin(url, headers["location"]), etag, redirects - 1)
+        return url, code, headers, reader, writer
+    except BaseException:
+        writer.close()
+        raise
+
+
+class Resolver:
+    def __init__(self, max_connections = MAX_CONNECTIONS, cache = None):
+        self.connections = asyncio.Semaphore(max_connections)
+        self.cache = cache if cache is not None else {}     # url -> {"etag", "format", "links"}
+        self.running = {}                                   # url -> task, one fetch per URL
+        self.fresh = {}                                     # url -> links checked in this run
+        self.fetched = 0
+        self.not_modified = 0
+        self.loops = 0
+
+    async def links(self, url):
+        """ Returns the links of the playlist at url, or None when url is a
+            stream. Simultaneous calls for one URL share the fetch. """
+        if url in self.fresh:
+            return self.fresh[url]
+        task = self.running.get(url)
+        if task is None:
+            task = self.running[url] = asyncio.ensure_future(self._fetch(url))
+            task.add_done_callback(lambda _: self.running.pop(url, None))
+        return await task
+
+    async def _fetch(self, url):
+        self.fresh[url] = links = await self._revalidate(url)
+        return links
+
+    async def _revalidate(self, url):
+        cached = self.cache.get(url)
+        async with self.connections:
+            final_url, code, headers, reader, writer = await asyncio.wait_for(
+                http_get(url, cached and cached.get("etag")), TIMEOUT)
+            try:
+                if code == 304 and cached:
+                    self.not_modified += 1
+                    return [Link(u, t) for u, t in cached["links"]] if cached["format"] else None
+                if code not in (200, 206):
+                    raise Error(f"Can't open {url}: HTTP {code}")
+
+                self.fetched += 1
+                fmt = url_format(final_url) or CONTENT_TYPES.get(headers.get("content-type", "").split(";")[0].strip().lower())
+                links = await asyncio.wait_for(self._read(reader, final_url, fmt, headers), TIMEOUT)
+            finally:
+                writer.close()
+
+        entry = {"format": fmt if links is not None else None, "links": [(l.url, l.title) for l in links or ()]}
+        if headers.get("etag"):
+            self.cache[url] = dict(entry, etag = headers["etag"])
+        return links
+
+    async def _read(self, reader, url, fmt, headers):
+        """ Parses the body while it arrives. An audio body is a stream, not a playlist. """
+        parser = PARSERS[fmt](url) if fmt in PARSERS else None
+        if parser is None and headers.get("content-type", "").startswith(("audio/", "video/")) and fmt != "hls":
+            return None
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors = "replace")
+        size = 0
+        head = ""
+        while chunk := await reader.read(CHUNK_SIZE):
+            size += len(chunk)
+            if size > MAX_SIZE:
+                if parser is None:
+                    return None
+                raise Error(f"{url}: the playlist is larger than {MAX_SIZE} bytes")
+            text = decoder.decode(chunk)
+            if parser is None:
+                # no hint from the URL or the headers, look at the content
+                head += text
+                fmt = content_format(head)
+                if fmt not in PARSERS:
+                    if fmt == "hls" or len(head) > 4096 or "\0" in head:
+                        return None
+                    continue
+                parser = PARSERS[fmt](url)
+                text, head = head, ""
+            parser.feed(text)
+
+        if parser is None:
+            return None
+        parser.feed(decoder.decode(b"", final = True))
+        links = parser.close()
+        return links or [Link(url)]
+
+    async def resolve(self, url, depth = 0, chain = ()):
+        """ Returns the stream URLs behind url, nested playlists are followed.
+            A link back into the chain or too deep nesting gives nothing. """
+        if url in chain or depth > MAX_DEPTH:
+            self.loops += 1
+            return []
+        if urllib.parse.urlsplit(url).scheme not in ("http", "https"):
+            return [url]
+
+        links = await self.links(url)
+        if links is None or (len(links) == 1 and links[0].url == url):
+            return [url]
+
+        chain = chain + (url,)
+        results = await asyncio.gather(*(self.resolve(l.url, depth + 1, chain) for l in links if url_format(l.url)),
+                                       return_exceptions = True)
+        nested = iter(results)
+        streams = []
+        for l in links:
+            if not url_format(l.url):
+                streams.append(l.url)
+                continue
+            r = next(nested)
+            if isinstance(r, list):     # a broken nested playlist is skipped
+                streams.extend(r)
+        return list(dict.fromkeys(streams))
+
+
+def load_cache(path):
+    try:
+        with open(path, "r", encoding = "utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(path, cache):
+    tmp = path + ".part"
+    with open(tmp, "w", encoding = "utf-8") as f:
+        json.dump(cache, f, ensure_ascii = False)
+    os.replace(tmp, path)
+
+
+#######################################
+# Fixtures: RadiolaTests/data/testPlayListTitles and testPlayListDownload
+
+def check_fixtures(data_dir):
+    """ Parses every source.* and compares the titles with expected.json
+        and the URLs with result.txt. Returns the number of failures,
+        no fixtures at all is a failure too. """
+    failures = 0
+    checked = 0
+    for source in sorted(glob.glob(os.path.join(data_dir, "testPlayList*", "*", "source.*"))):
+        folder = os.path.dirname(source)
+        with open(source, "r", encoding = "utf-8") as f:
+            text = f.read()
+        base = "file://" + urllib.parse.quote(os.path.abspath(source))
+        fmt = FORMATS.get(os.path.splitext(source)[1].lstrip(".").lower())
+        links = parse(text, base, fmt) or [Link(base)]
+
+        for name, actual, read in (
+                ("expected.json", [l.title or "" for l in links], lambda f: json.load(f)),
+                ("result.txt", [l.url for l in links], lambda f: [s.strip() for s in f if s.strip()])):
+            path = os.path.join(folder, name)
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding = "utf-8") as f:
+                expected = read(f)
+            checked += 1
+            if actual != expected:
+                failures += 1
+                print(f"FAILED {os.path.relpath(path, data_dir)}\n  expected: {expected}\n  actual:   {actual}")
+            else:
+                print(f"ok     {os.path.relpath(path, data_dir)}")
+
+    print(f"{checked} checks, {failures} failed")
+    return failures if checked else 1
+
+
+async def resolve_all(urls, max_connections, cache):
+    resolver = Resolver(max_connections, cache)
+    results = await asyncio.gather(*(resolver.resolve(u) for u in urls), return_exceptions = True)
+    for url, result in zip(urls, results):
+        if isinstance(result, BaseException):
+            print(f"{url}\tERROR\t{result or type(result).__name__}")
+        else:
+            for stream in result:
+                print(f"{url}\t{stream}")
+    print(f"Fetched {resolver.fetched}, not modified {resolver.not_modified}, loops {resolver.loops}", file = sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Resolve m3u, pls, asx and xspf playlists to stream URLs.")
+    parser.add_argument("url", nargs = "*", help = "playlist URLs")
+    parser.add_argument("-f", "--file", help = "read the URLs from a file, one per line")
+    parser.add_argument("-c", "--max-connections", type = int, default = MAX_CONNECTIONS,
+                        help = f"simultaneous downloads (default: {MAX_CONNECTIONS})")
+    parser.add_argument("--cache", metavar = "FILE", help = "keep the results by URL + ETag in the file")
+    parser.add_argument("--check", metavar = "DIR", help = "check the parsers against the playlist fixtures in DIR")
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(1 if check_fixtures(args.check) else 0)
+
+    urls = list(args.url)
+    if args.file:
+        with open(args.file, "r", encoding = "utf-8") as f:
+            urls += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    if not urls:
+        parser.error("no playlist URL given")
+
+    cache = load_cache(args.cache) if args.cache else {}
+    try:
+        asyncio.run(resolve_all(list(dict.fromkeys(urls)), args.max_connections, cache))
+    except KeyboardInterrupt:
+        sys.exit(1)
+    if args.cache:
+        save_cache(args.cache, cache)
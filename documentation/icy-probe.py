@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+
+# Checks that the streams of a station list are alive: opens every stream
+# with the icy-meta.py engine, reads the headers and the first audio bytes
+# and closes it. The codec and the real bitrate are found in these bytes
+# by icy-sniff.py, playlist URLs are resolved by icy-playlist.py and their
+# first stream is probed. The result is a sorted table, so two runs can be
+# diffed.
+#
+#   ./icy-probe.py radio-browser.stations.json.tmp -o today.tsv
+#   diff yesterday.tsv today.tsv
+#   ./icy-probe.py --check
+
+import argparse
+import asyncio
+import collections
+import importlib.util
+import json
+import os
+import re
+import socket
+import ssl
+import sys
+import tempfile
+import time
+import urllib.parse
+
+
+def load_script(name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    spec = importlib.util.spec_from_file_location(os.path.basename(name).replace("-", "_").removesuffix(".py"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+icy = load_script("icy-meta.py")
+sniffer = load_script("icy-sniff.py")
+playlist = load_script("icy-playlist.py")
+# iter_stations() reads the RadioBrowser dump one station at a time
+dl = load_script("../RadiolaTests/data/testRadioBrowserStationInit/download-all-stations.py")
+
+MAX_CONNECTIONS = 200
+MAX_HOST_CONNECTIONS = 4    # a server with many stations is not hit by all of them at once
+TIMEOUT = 10                # seconds per station, from connect to the first bytes
+PROBE_BYTES = 4096          # audio bytes to read, enough for a few MP3 or AAC frames
+
+COLUMNS = ("station", "state", "content-type", "icy-br", "icy-metaint", "bytes", "container", "codec", "kbps", "error")
+URL_RE = re.compile(r"\S+://\S+")
+
+
+class Result:
+    def __init__(self, key, url):
+        self.key = key
+        self.url = url
+        self.state = "OK"
+        self.headers = {}
+        self.data = b""
+        self.sniff = None
+        self.error = ""
+        self.elapsed = 0.0
+
+    def row(self, timing = False):
+        values = [
+            self.key,
+            self.state,
+            self.headers.get("content-type", "-"),
+            self.headers.get("icy-br", "-"),
+            self.headers.get("icy-metaint", "-"),
+            str(len(self.data)),
+            self.sniff.container if self.sniff else "-",
+            self.sniff.codec if self.sniff else "-",
+            str(self.sniff.bitrate or "-") if self.sniff else "-",
+            self.error or "-",
+        ]
+        if timing:
+            values.append(f"{self.elapsed * 1000:.0f}")
+        return "\t".join(v.replace("\t", " ") or "-" for v in values)
+
+
+def describe_error(err):
+    """ A short message without URLs and timings, so it stays the same between runs. """
+    if isinstance(err, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(err, socket.gaierror):
+        return "dns"
+    if isinstance(err, ConnectionRefusedError):
+        return "refused"
+    if isinstance(err, ConnectionResetError):
+        return "reset"
+    if isinstance(err, ssl.SSLError):
+        return "tls"
+    if isinstance(err, asyncio.IncompleteReadError):
+        return "closed"
+    msg = URL_RE.sub("URL", str(err)).strip()
+    return msg[:80] if msg else type(err).__name__
+
+
+class Prober:
+    def __init__(self, max_connections = MAX_CONNECTIONS, max_host_connections = MAX_HOST_CONNECTIONS,
+                 timeout = TIMEOUT, probe_bytes = PROBE_BYTES):
+        self.connections = asyncio.Semaphore(max_connections)
+        self.hosts = collections.defaultdict(lambda: asyncio.Semaphore(max_host_connections))
+        self.timeout = timeout
+        self.probe_bytes = probe_bytes
+        self.resolver = playlist.Resolver(max_connections)
+        self.done = 0
+
+    async def read_head(self, stream, meta_interval):
+        """ Reads the first probe_bytes of audio, less if the stream ends.
+            The metadata blocks are cut out, so the frames stay contiguous. """
+        data = bytearray()
+        try:
+            while len(data) < self.probe_bytes:
+                size = min(self.probe_bytes - len(data), meta_interval or self.probe_bytes)
+                data += await stream.read(size)
+                if meta_interval and size == meta_interval:
+                    await stream.skip(await stream.read_byte() * 16)
+        except asyncio.IncompleteReadError as err:
+            data += err.partial
+        return bytes(data)
+
+    async def probe_stream(self, result):
+        url = result.url
+        if playlist.url_format(url) in playlist.PARSERS:
+            streams = await self.resolver.resolve(url)
+            if not streams:
+                raise playlist.Error("Empty playlist")
+            url = streams[0]
+
+        stream, result.headers = await icy.open_stream(url)
+        try:
+            value = result.headers.get("icy-metaint", "")
+            meta_interval = int(value) if value.strip().isdigit() else 0
+            result.data = await self.read_head(stream, meta_interval)
+        finally:
+            stream.close()
+        if result.data:
+            result.sniff = sniffer.sniff(result.data)
+
+    async def probe(self, result):
+        host = urllib.parse.urlsplit(result.url).hostname or ""
+        async with self.hosts[host], self.connections:
+            start = time.monotonic()
+            try:
+                await asyncio.wait_for(self.probe_stream(result), self.timeout)
+                if not result.data:
+                    result.state = "NOAUDIO"
+            except asyncio.TimeoutError as err:
+                result.state = "TIMEOUT"
+                result.error = describe_error(err)
+            except icy.STREAM_ERRORS + (playlist.Error,) as err:
+                result.state = "ERROR"
+                result.error = describe_error(err)
+            result.elapsed = time.monotonic() - start
+        self.done += 1
+        return result
+
+    async def run(self, targets, progress = None):
+        results = [Result(key, url) for key, url in targets]
+        tasks = [asyncio.create_task(self.probe(r)) for r in results]
+        while progress and not all(t.done() for t in tasks):
+            progress(self.done, len(tasks))
+            await asyncio.wait(tasks, timeout = 1)
+        await asyncio.gather(*tasks)
+        return sorted(results, key = lambda r: r.key)
+
+
+def load_targets(path, duplicates = None):
+    """ Returns (key, url) pairs. The key is the stationuuid for a RadioBrowser
+        dump and the URL for other lists. Stations listed as duplicates in
+        the output of dedupe-stations.py are skipped. The dump is read one
+        station at a time, only the pairs are kept. """
+    skip = set()
+    if duplicates:
+        with open(duplicates, "r", encoding = "utf-8") as f:
+            for line in f:
+                if line.strip():
+                    skip.update(d["stationuuid"] for d in json.loads(line)["duplicates"])
+
+    with open(path, "r", encoding = "utf-8") as f:
+        head = f.read(1024).lstrip()
+
+    if not head.startswith("["):
+        return [(url, url) for url in icy.load_stations(path)]
+
+    targets = []
+    with open(path, "r", encoding = "utf-8") as f:
+        for item in dl.iter_stations(f):
+            if isinstance(item, str):
+                targets.append((item, item))
+                continue
+            if not isinstance(item, dict):
+                continue
+            url = item.get("url_resolved") or item.get("url")
+            key = item.get("stationuuid") or url
+            if url and key not in skip:
+                targets.append((key, url))
+    return targets
+
+
+def write_table(results, out, timing = False):
+    print("\t".join(COLUMNS + (("ms",) if timing else ())), file = out)
+    for r in results:
+        print(r.row(timing), file = out)
+
+
+def print_progress(done, total):
+    print(f"\r  {done} / {total}", end = "", file = sys.stderr, flush = True)
+
+
+#######################################
+# Check: a local server farm with every kind of a station
+
+class Farm:
+    """ One local server, the path picks the way the station behaves.
+        The other paths are ICY stations of icy-server.py. """
+
+    def __init__(self):
+        args = argparse.Namespace(meta_interval = 1000, bitrate = 128, chunk_size = 4096, burst = 65536,
+                                  title_interval = 0, drop_after = 0, icy_status = False)
+        self.icy = load_script("icy-server.py").Server(args)
+        self.url = None
+        self.handlers = set()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.url = f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+
+    async def handle(self, reader, writer):
+        self.handlers.add(asyncio.current_task())
+        try:
+            request = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+            path = request.split(None, 2)[1]
+            if path == "/silent":
+                # the answer never comes, wait for the client to give up
+                await reader.read()
+            elif path == "/missing":
+                writer.write(b"HTTP/1.0 404 Not Found\r\n\r\n")
+            elif path == "/empty":
+                writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: audio/mpeg\r\n\r\n")
+            elif path == "/moved":
+                writer.write(f"HTTP/1.0 302 Found\r\nLocation: {self.url}/station\r\n\r\n".encode("latin-1"))
+            elif path == "/list.m3u":
+                writer.write(f"HTTP/1.0 200 OK\r\nContent-Type: audio/x-mpegurl\r\n\r\n"
+                             f"#EXTM3U\n{self.url}/station\n".encode("latin-1"))
+            else:
+                await self.stream(reader, writer, path, "icy-metadata: 1" in request.lower())
+            await writer.drain()
+        except (OSError, IndexError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def stream(self, reader, writer, path, with_meta):
+        """ Serves an icy-server.py station until the client hangs up. """
+        serving = asyncio.create_task(self.icy.serve(writer, self.icy.station(path), with_meta))
+        try:
+            await reader.read()
+        finally:
+            serving.cancel()
+
+    async def close(self):
+        self.server.close()
+        await asyncio.gather(*self.handlers)
+
+
+def refused_url():
+    """ A port nobody listens on. """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}"
+
+
+async def check_farm(tmp):
+    """ Probes a dump of the farm stations and compares the states.
+        Returns the number of failures. """
+    farm = Farm()
+    await farm.start()
+    url = farm.url
+    stations = [
+        {"stationuuid": "station", "url": f"{url}/station"},
+        {"stationuuid": "redirect", "url": f"{url}/moved"},
+        {"stationuuid": "playlist", "url": "http://example.invalid/old", "url_resolved": f"{url}/list.m3u"},
+        {"stationuuid": "silent", "url": f"{url}/silent"},
+        {"stationuuid": "missing", "url": f"{url}/missing"},
+        {"stationuuid": "no-audio", "url": f"{url}/empty"},
+        {"stationuuid": "refused", "url": f"{refused_url()}/station"},
+        {"stationuuid": "duplicate", "url": f"{url}/station"},
+        {"stationuuid": "no-url", "url": ""},
+        f"{url}/plain",
+    ]
+    expected = {
+        "station": ("OK", "MP3"),
+        "redirect": ("OK", "MP3"),
+        "playlist": ("OK", "MP3"),
+        "silent": ("TIMEOUT", "-"),
+        "missing": ("ERROR", "-"),
+        "no-audio": ("NOAUDIO", "-"),
+        "refused": ("ERROR", "-"),
+        f"{url}/plain": ("OK", "MP3"),
+    }
+
+    dump = os.path.join(tmp, "stations.json")
+    with open(dump, "w", encoding = "utf-8") as f:
+        json.dump(stations, f)
+    duplicates = os.path.join(tmp, "duplicates.jsonl")
+    with open(duplicates, "w", encoding = "utf-8") as f:
+        print(json.dumps({"primary": {"stationuuid": "station"}, "duplicates": [{"stationuuid": "duplicate"}]}), file = f)
+
+    try:
+        results = await Prober(timeout = 2).run(load_targets(dump, duplicates))
+    finally:
+        await farm.close()
+
+    failed = 0
+    got = {r.key: r for r in results}
+    for key in sorted(set(expected) | set(got)):
+        r = got.get(key)
+        state = (r.state, r.sniff.codec if r and r.sniff else "-") if r else ("skipped", "-")
+        ok = state == expected.get(key, ("skipped", "-"))
+        if r and r.state == "OK" and not (r.sniff and r.sniff.bitrate == 128):
+            ok = False
+        failed += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {key}: {r.row() if r else 'skipped'}")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check that the streams of a station list are alive.")
+    parser.add_argument("stations", nargs = "?", help = "RadioBrowser JSON dump, OPML or a text file with URLs")
+    parser.add_argument("-o", "--output", help = "write the table to the file instead of stdout")
+    parser.add_argument("-c", "--max-connections", type = int, default = MAX_CONNECTIONS,
+                        help = f"simultaneous probes (default: {MAX_CONNECTIONS})")
+    parser.add_argument("--per-host", type = int, default = MAX_HOST_CONNECTIONS,
+                        help = f"simultaneous probes per host (default: {MAX_HOST_CONNECTIONS})")
+    parser.add_argument("--timeout", type = float, default = TIMEOUT,
+                        help = f"seconds per station (default: {TIMEOUT})")
+    parser.add_argument("--bytes", type = int, default = PROBE_BYTES,
+                        help = f"audio bytes to read (default: {PROBE_BYTES})")
+    parser.add_argument("--skip-duplicates", metavar = "FILE",
+                        help = "skip the duplicates found by dedupe-stations.py")
+    parser.add_argument("--timing", action = "store_true",
+                        help = "add a column with the probe time, ms (the table is no longer diffable)")
+    parser.add_argument("--check", action = "store_true",
+                        help = "probe a farm of local servers, one for every kind of a station, and compare the states")
+    args = parser.parse_args()
+
+    if args.check:
+        with tempfile.TemporaryDirectory() as tmp:
+            exit(1 if asyncio.run(check_farm(tmp)) else 0)
+    if not args.stations:
+        parser.error("the stations file is required")
+
+    try:
+        targets = load_targets(args.stations, args.skip_duplicates)
+    except (OSError, dl.Error) as err:
+        print(f"Error: {err}", file = sys.stderr)
+        exit(1)
+    prober = Prober(args.max_connections, args.per_host, args.timeout, args.bytes)
+
+    start = time.monotonic()
+    try:
+        results = asyncio.run(prober.run(targets, print_progress))
+    except KeyboardInterrupt:
+        exit(1)
+    elapsed = time.monotonic() - start
+
+    if args.output:
+        with open(args.output, "w", encoding = "utf-8") as out:
+            write_table(results, out, args.timing)
+    else:
+        write_table(results, sys.stdout, args.timing)
+
+    states = collections.Counter(r.state for r in results)
+    print(f"\r  {len(results)} stations in {elapsed:.1f} s: " +
+          ", ".join(f"{state} {n}" for state, n in sorted(states.items())), file = sys.stderr)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+# Local ICY stream simulator for icy-meta.py benchmarks.
+# Every URL path is a separate station: http://127.0.0.1:8000/station-1
+
+import argparse
+import asyncio
+import random
+import time
+
+
+class Station:
+    """ Titles change every title_interval seconds, the same for all listeners of the station.
+        The title carries the time of the change, so a client can measure its latency. """
+
+    def __init__(self, name, title_interval):
+        self.name = name
+        self.title_interval = title_interval
+        self.offset = random.uniform(0, title_interval)
+
+    def title(self):
+        if not self.title_interval:
+            return f"{self.name} - song 0 @0"
+
+        n = int((time.time() + self.offset) // self.title_interval)
+        changed = n * self.title_interval - self.offset
+        return f"{self.name} - song {n} @{changed:.6f}"
+
+
+MP3_BITRATES = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+
+
+def mp3_frames(bitrate, min_size):
+    """ Silent MPEG-1 Layer III frames at 44.1 kHz, at least min_size bytes,
+        so a client can find the codec and measure the bitrate. """
+    if bitrate not in MP3_BITRATES[1:]:
+        return b"\xff\xfb\x90\x64" * (min_size // 4 + 1)
+
+    index = MP3_BITRATES.index(bitrate)
+    size, fraction = divmod(144 * bitrate * 1000, 44100)
+    frames = bytearray()
+    rest = 0
+    while len(frames) < min_size:
+        # a padding byte now and then keeps the average at the exact bitrate
+        rest += fraction
+        padding = int(rest >= 44100)
+        rest -= padding * 44100
+        frames += bytes([0xFF, 0xFB, index << 4 | padding << 1, 0x44]) + bytes(size + padding - 4)
+    return bytes(frames)
+
+
+def metadata_block(title):
+    data = f"StreamTitle='{title}';".encode("utf-8")
+    size = (len(data) + 15) // 16
+    return bytes([size]) + data.ljust(size * 16, b"\0")
+
+
+class Server:
+    def __init__(self, args):
+        self.args = args
+        self.stations = {}
+        frames = mp3_frames(args.bitrate, args.chunk_size)
+        self.loop = len(frames)
+        self.audio = memoryview(frames * 2)    # any chunk from any offset is a plain slice
+
+    def station(self, path):
+        if path not in self.stations:
+            self.stations[path] = Station(path.strip("/") or "station", self.args.title_interval)
+        return self.stations[path]
+
+    async def handle(self, reader, writer):
+        try:
+            request = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+            path = request.split(None, 2)[1]
+            with_meta = "icy-metadata: 1" in request.lower()
+            await self.serve(writer, self.station(path), with_meta)
+        except (OSError, IndexError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, writer, station, with_meta):
+        args = self.args
+        status = "ICY 200 OK" if args.icy_status else "HTTP/1.0 200 OK"
+        headers = [
+            status,
+            "Content-Type: audio/mpeg",
+            f"icy-name: {station.name}",
+            f"icy-br: {args.bitrate}",
+        ]
+        if with_meta:
+            headers.append(f"icy-metaint: {args.meta_interval}")
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1"))
+
+        loop = asyncio.get_running_loop()
+        byte_rate = args.bitrate * 1000 / 8
+        chunk_time = args.chunk_size / byte_rate
+        drop_at = loop.time() + random.expovariate(1 / args.drop_after) if args.drop_after else None
+
+        sent_title = None
+        pos = 0
+        until_meta = args.meta_interval
+        burst = args.burst
+        next_time = loop.time()
+
+        while True:
+            size = args.chunk_size
+            while size > 0:
+                n = min(size, until_meta) if with_meta else size
+                writer.write(self.audio[pos:pos + n])
+                pos = (pos + n) % self.loop
+                size -= n
+                until_meta -= n
+                if with_meta and until_meta == 0:
+                    title = station.title()
+                    if title != sent_title:
+                        writer.write(metadata_block(title))
+                        sent_title = title
+                    else:
+                        writer.write(b"\0")
+                    until_meta = args.meta_interval
+
+            await writer.drain()
+
+            if drop_at and loop.time() >= drop_at:
+                writer.transport.abort()
+                return
+
+            if burst > 0:
+                burst -= args.chunk_size
+                continue
+
+            next_time += chunk_time
+            await asyncio.sleep(max(0, next_time - loop.time()))
+
+
+async def main(args):
+    server = Server(args)
+    srv = await asyncio.start_server(server.handle, args.host, args.port, backlog = 4096)
+    print(f"Serving ICY streams on http://{args.host}:{args.port}/<station>", flush = True)
+    async with srv:
+        await srv.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Local ICY stream simulator.")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8000)
+    parser.add_argument("--meta-interval", type = int, default = 8192, help = "icy-metaint (default: 8192)")
+    parser.add_argument("--bitrate", type = int, default = 128, help = "kbit/s, sets the pacing (default: 128)")
+    parser.add_argument("--chunk-size", type = int, default = 4096, help = "bytes sent at once (default: 4096)")
+    parser.add_argument("--burst", type = int, default = 0, help = "bytes sent without pacing after connect (default: 0)")
+    parser.add_argument("--title-interval", type = float, default = 10, help = "seconds between title changes, 0 - never (default: 10)")
+    parser.add_argument("--drop-after", type = float, default = 0, help = "mean seconds before the server drops a connection, 0 - never (default: 0)")
+    parser.add_argument("--icy-status", action = "store_true", help = "answer 'ICY 200 OK' instead of 'HTTP/1.0 200 OK'")
+
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
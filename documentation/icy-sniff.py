@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+# Finds the container, the codec and the real bitrate of a stream from its
+# first few KB, without decoding audio: MP3 and ADTS AAC frame headers,
+# Ogg (Vorbis, Opus, FLAC, Speex) and native FLAC.
+#
+#   ./icy-sniff.py first-4k-of-stream.bin ...
+
+import argparse
+import sys
+
+
+MIN_FRAMES = 3              # consecutive frame headers that prove the sync is real
+
+MP3_BITRATES = {
+    # (version, layer): kbit/s by the bitrate index
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MP3_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+MP3_VERSIONS = {3: 1, 2: 2, 0: 2.5}
+MP3_LAYERS = {3: 1, 2: 2, 1: 3}
+
+ADTS_SAMPLE_RATES = (96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350)
+ADTS_PROFILES = ("AAC Main", "AAC LC", "AAC SSR", "AAC LTP")
+
+
+class Sniff:
+    def __init__(self, container, codec, bitrate = None, sample_rate = None, channels = None):
+        self.container = container
+        self.codec = codec
+        self.bitrate = bitrate          # kbit/s, measured from the frames when possible
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+    def __repr__(self):
+        return (f"Sniff({self.container!r}, {self.codec!r}, bitrate = {self.bitrate}, "
+                f"sample_rate = {self.sample_rate}, channels = {self.channels})")
+
+
+UNKNOWN = Sniff("unknown", "")
+
+
+#######################################
+# Frame headers: (frame size, samples, sample rate, channels, codec) or None
+
+def mp3_frame(data, pos):
+    if pos + 4 > len(data) or data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+    version = MP3_VERSIONS.get((b1 >> 3) & 3)
+    layer = MP3_LAYERS.get((b1 >> 1) & 3)
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 3
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    bitrate = MP3_BITRATES[(min(version, 2), layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 1
+    channels = 1 if (b3 >> 6) == 3 else 2
+
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate, channels, "MP1"
+    samples = 576 if layer == 3 and version != 1 else 1152
+    size = samples // 8 * bitrate // sample_rate + padding
+    return size, samples, sample_rate, channels, f"MP{layer}"
+
+
+def adts_frame(data, pos):
+    if pos + 7 > len(data) or data[pos] != 0xFF or data[pos + 1] & 0xF6 != 0xF0:
+        return None
+    b2, b3, b4, b5, b6 = data[pos + 2:pos + 7]
+    rate_index = (b2 >> 2) & 0xF
+    if rate_index >= len(ADTS_SAMPLE_RATES):
+        return None
+    size = ((b3 & 3) << 11) | (b4 << 3) | (b5 >> 5)
+    header = 7 if data[pos + 1] & 1 else 9
+    if size <= header:
+        return None
+    channels = ((b2 & 1) << 2) | (b3 >> 6)
+    samples = 1024 * ((b6 & 3) + 1)
+    return size, samples, ADTS_SAMPLE_RATES[rate_index], channels, ADTS_PROFILES[b2 >> 6]
+
+
+def frame_chain(data, pos, parse):
+    """ Follows the frames from pos. Returns (frames, bytes, seconds, first
+        header) when at least MIN_FRAMES headers are found in a row, or two
+        when the end of the data cuts the chain. """
+    first = parse(data, pos)
+    if first is None:
+        return None
+
+    frames = size = 0
+    seconds = 0.0
+    cut = False
+    while True:
+        frame = parse(data, pos)
+        if frame is None or frame[2] != first[2] or frame[4] != first[4]:
+            # the last few bytes may hold only a part of the header
+            cut = len(data) - pos < 9
+            break
+        if pos + frame[0] > len(data):
+            cut = True
+            break
+        frames += 1
+        size += frame[0]
+        seconds += frame[1] / frame[2]
+        pos += frame[0]
+
+    if frames >= MIN_FRAMES or (frames >= 2 and cut):
+        return frames, size, seconds, first
+    return None
+
+
+def sniff_frames(data):
+    """ Looks for the first run of MP3 or ADTS frames. """
+    start = skip_id3(data)
+    pos = data.find(b"\xff", start)
+    while 0 <= pos < len(data) - 3:
+        for parse, container in ((adts_frame, "adts"), (mp3_frame, "mpeg")):
+            chain = frame_chain(data, pos, parse)
+            if chain:
+                frames, size, seconds, (_, _, sample_rate, channels, codec) = chain
+                bitrate = round(size * 8 / seconds / 1000) if seconds else None
+                return Sniff(container, codec, bitrate, sample_rate, channels)
+        pos = data.find(b"\xff", pos + 1)
+    return None
+
+
+def skip_id3(data):
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+        return 10 + size + (10 if data[5] & 0x10 else 0)
+    return 0
+
+
+#######################################
+# Containers with a header: Ogg and FLAC
+
+def flac_streaminfo(block):
+    """ Sample rate and channels from the STREAMINFO block body. """
+    if len(block) < 18:
+        return None, None
+    sample_rate = (block[10] << 12) | (block[11] << 4) | (block[12] >> 4)
+    channels = ((block[12] >> 1) & 7) + 1
+    return sample_rate, channels
+
+
+def sniff_ogg(data, pos):
+    if len(data) < pos + 28:
+        return Sniff("ogg", "")
+    segments = data[pos + 26]
+    packet = data[pos + 27 + segments:]
+
+    if packet[:7] == b"\x01vorbis" and len(packet) >= 24:
+        channels = packet[11]
+        sample_rate = int.from_bytes(packet[12:16], "little")
+        nominal = int.from_bytes(packet[20:24], "little", signed = True)
+        return Sniff("ogg", "Vorbis", nominal // 1000 if nominal > 0 else None, sample_rate, channels)
+    if packet[:8] == b"OpusHead" and len(packet) >= 16:
+        # Opus always runs at 48 kHz, the header keeps the rate of the source
+        return Sniff("ogg", "Opus", None, 48000, packet[9])
+    if packet[:5] == b"\x7fFLAC" and packet[9:13] == b"fLaC":
+        sample_rate, channels = flac_streaminfo(packet[17:])
+        return Sniff("ogg", "FLAC", None, sample_rate, channels)
+    if packet[:8] == b"Speex   ":
+        return Sniff("ogg", "Speex", None, int.from_bytes(packet[36:40], "little") or None)
+    return Sniff("ogg", "")
+
+
+def sniff_flac(data, pos):
+    sample_rate, channels = None, None
+    if data[pos + 4] & 0x7F == 0:    # the first metadata block is STREAMINFO
+        sample_rate, channels = flac_streaminfo(data[pos + 8:pos + 8 + 34])
+    return Sniff("flac", "FLAC", None, sample_rate, channels)
+
+
+def sniff(data):
+    """ Returns Sniff for the first bytes of a stream. """
+    data = bytes(data)
+    head = data[:512].lstrip()
+    lower = head.lower()
+
+    pos = data.find(b"OggS")
+    if pos == 0 or (0 < pos < 64 * 1024 and data[pos + 4:pos + 5] == b"\0"):
+        return sniff_ogg(data, pos)
+    if data[:4] == b"fLaC" and len(data) >= 8:
+        return sniff_flac(data, 0)
+    if data[4:8] == b"ftyp":
+        return Sniff("mp4", "")
+
+    frames = sniff_frames(data)
+    if frames:
+        return frames
+
+    if lower.startswith(b"#extm3u"):
+        return Sniff("hls" if b"#ext-x-" in lower else "m3u", "")
+    if lower.startswith(b"[playlist]"):
+        return Sniff("pls", "")
+    if lower.startswith((b"<!doctype html", b"<html")):
+        return Sniff("html", "")
+    if lower.startswith(b"<?xml") or lower.startswith(b"<asx"):
+        return Sniff("xml", "")
+    return UNKNOWN
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Find the codec and the bitrate from the first bytes of a stream.")
+    parser.add_argument("files", nargs = "+", help = "files with the first bytes of streams")
+    parser.add_argument("--bytes", type = int, default = 4096, help = "bytes to look at (default: 4096)")
+    args = parser.parse_args()
+
+    for path in args.files:
+        try:
+            with open(path, "rb") as f:
+                s = sniff(f.read(args.bytes))
+        except OSError as err:
+            print(f"{path}: {err}", file = sys.stderr)
+            continue
+        print(f"{path}\t{s.container}\t{s.codec or '-'}\t{s.bitrate or '-'}\t{s.sample_rate or '-'}\t{s.channels or '-'}")
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+# Merges one OPML bookmarks file into another the way the app does it
+# (Radiola/Stations/StationsMerger.swift): new stations and groups are
+# inserted after their neighbour from the new file, existing stations get
+# the title and the favorite flag of the new file. Nothing is deleted.
+#
+# StationsMerger looks for stations and groups with linear scans. Here
+# every group is found by its path of titles and every station by the
+# (group path, url) pair in dicts, and the items of a group are a linked
+# list, so an insert does not shift the rest. The whole merge is O(n).
+#
+#   ./merge-stations.py bookmarks.opml exported.opml -o merged.opml
+#   ./merge-stations.py --check ../RadiolaTests/data/testStationMerger
+
+import argparse
+import os
+import sys
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
+
+
+class Error(Exception):
+    pass
+
+
+class Item:
+    def __init__(self, title):
+        self.title = title
+        self.next = None        # the next item of the parent group
+
+
+class Station(Item):
+    def __init__(self, title, url, fav = False):
+        super().__init__(title)
+        self.url = url
+        self.fav = fav
+
+
+class Group(Item):
+    def __init__(self, title):
+        super().__init__(title)
+        self.head = None
+        self.tail = None
+
+    def items(self):
+        item = self.head
+        while item:
+            yield item
+            item = item.next
+
+    def append(self, item):
+        if self.tail:
+            self.tail.next = item
+        else:
+            self.head = item
+        self.tail = item
+
+    def insert_after(self, prev, item):
+        """ Inserts item after prev, or at the top when prev is None. """
+        if prev is None:
+            item.next = self.head
+            self.head = item
+        else:
+            item.next = prev.next
+            prev.next = item
+        if item.next is None:
+            self.tail = item
+
+
+#######################################
+# OPML
+
+def is_true(xml, attribute):
+    return xml.get(attribute, "").upper() == "TRUE"
+
+
+def load_outline(xml, parent):
+    children = xml.findall("outline")
+    if is_true(xml, "group") or children:
+        group = Group(xml.get("text", ""))
+        for outline in children:
+            load_outline(outline, group)
+        parent.append(group)
+        return
+
+    parent.append(Station(xml.get("text", ""), xml.get("url", ""), is_true(xml, "fav")))
+
+
+def load(path):
+    """ Reads the file like OpmlStations.load(). Returns the root group. """
+    try:
+        root = ET.parse(path).getroot()
+    except (OSError, ET.ParseError) as err:
+        raise Error(f"Can't read the stations file {path}: {err}")
+
+    stations = Group("")
+    body = root.find("body")
+    if body is not None:
+        for outline in body.findall("outline"):
+            load_outline(outline, stations)
+    return stations
+
+
+def write_outline(out, item, indent):
+    attrs = f"text={quoteattr(item.title)}"
+    if isinstance(item, Station):
+        attrs += f" url={quoteattr(item.url)}"
+        if item.fav:
+            attrs += ' fav="true"'
+        out.append(f'{indent}<outline {attrs}></outline>')
+        return
+
+    out.append(f'{indent}<outline {attrs} group="true">')
+    for it in item.items():
+        write_outline(out, it, indent + "    ")
+    out.append(f"{indent}</outline>")
+
+
+def as_xml(stations):
+    """ The same document as StationList.asXML(), pretty printed. """
+    out = ['<?xml version="1.0" encoding="UTF-8"?>', '<ompl version="2.0">', "    <head></head>", "    <body>"]
+    for item in stations.items():
+        write_outline(out, item, "        ")
+    out += ["    </body>", "</ompl>", ""]
+    return "\n".join(out)
+
+
+def save(stations, path):
+    tmp = path + ".part"
+    with open(tmp, "w", encoding = "utf-8") as f:
+        f.write(as_xml(stations))
+    os.replace(tmp, path)
+
+
+#######################################
+# Merge
+
+class Merger:
+    def __init__(self, current):
+        self.current = current
+        self.groups = {}        # group path -> the first group with this path
+        self.stations = {}      # (group path, url) -> stations with this url, in the file order
+        self.inserted_stations = 0
+        self.updated_stations = 0
+        self.inserted_groups = 0
+        self.index(current, ())
+
+    def index(self, group, path):
+        self.groups[path] = group
+        for item in group.items():
+            if isinstance(item, Station):
+                self.stations.setdefault((path, item.url), []).append(item)
+            elif path + (item.title,) not in self.groups:
+                # a group with the title of an earlier one is never found by the merger
+                self.index(item, path + (item.title,))
+
+    def find_station(self, path, src):
+        """ The station with the url and the title, or just with the url. """
+        same_url = self.stations.get((path, src.url))
+        if not same_url:
+            return None
+        for station in same_url:
+            if station.title == src.title:
+                return station
+        return same_url[0]
+
+    def insert_after(self, path, prev):
+        """ The item of the current group after which the new item goes,
+            None for the top of the group. """
+        if isinstance(prev, Station):
+            same_url = self.stations.get((path, prev.url))
+            if same_url:
+                return same_url[0]
+        if isinstance(prev, Group):
+            return self.groups.get(path + (prev.title,))
+        return None
+
+    def merge(self, src, path = ()):
+        dest = self.groups[path]
+        prev = None
+        for item in src.items():
+            if isinstance(item, Station):
+                self.merge_station(item, prev, dest, path)
+            else:
+                self.merge_group(item, prev, dest, path)
+            prev = item
+
+    def merge_group(self, src, prev, dest, path):
+        sub_path = path + (src.title,)
+        if sub_path not in self.groups:
+            group = Group(src.title)
+            dest.insert_after(self.insert_after(path, prev), group)
+            self.groups[sub_path] = group
+            self.inserted_groups += 1
+        self.merge(src, sub_path)
+
+    def merge_station(self, src, prev, dest, path):
+        station = self.find_station(path, src)
+        if station:
+            if station.title != src.title or station.fav != src.fav:
+                self.updated_stations += 1
+            station.title = src.title
+            station.fav = src.fav
+            return
+
+        station = Station(src.title, src.url, src.fav)
+        dest.insert_after(self.insert_after(path, prev), station)
+        # the url was not in the group, so this is its only station
+        self.stations[(path, src.url)] = [station]
+        self.inserted_stations += 1
+
+
+def merge(current, new):
+    """ Merges new into current in place and returns the Merger with the statistics. """
+    merger = Merger(current)
+    merger.merge(new)
+    return merger
+
+
+#######################################
+# Fixtures
+
+def check_fixtures(data_dir):
+    """ Runs the merger on every current.opml + new.opml pair of the app tests
+        and compares with result.opml. Returns the number of failures. """
+    failed = 0
+    dirs = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    for d in dirs:
+        path = os.path.join(data_dir, d)
+        current = load(os.path.join(path, "current.opml"))
+        merge(current, load(os.path.join(path, "new.opml")))
+        ok = as_xml(current) == as_xml(load(os.path.join(path, "result.opml")))
+        failed += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {d}")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Merge OPML bookmarks the way Radiola does.")
+    parser.add_argument("current", nargs = "?", help = "the bookmarks to merge into")
+    parser.add_argument("new", nargs = "?", help = "the bookmarks to add")
+    parser.add_argument("-o", "--output", help = "write the result to the file instead of stdout")
+    parser.add_argument("--check", metavar = "DIR", help = "check the merger on the testStationMerger fixtures")
+    args = parser.parse_args()
+
+    try:
+        if args.check:
+            exit(1 if check_fixtures(args.check) else 0)
+
+        if not args.current or not args.new:
+            parser.error("current and new files are required")
+
+        current = load(args.current)
+        merger = merge(current, load(args.new))
+        if args.output:
+            save(current, args.output)
+        else:
+            sys.stdout.write(as_xml(current))
+
+        print(f"Inserted stations: {merger.inserted_stations}, updated stations: {merger.updated_stations}, "
+              f"inserted groups: {merger.inserted_groups}", file = sys.stderr)
+    except Error as err:
+        print(f"Error: {err}", file = sys.stderr)
+        exit(1)